@@ -1,64 +1,51 @@
-from utils import send_cmd, open_commissioning_window, commission_pairing_code, commission_bleThread, CommandError
-from utils.jlink_logger import start_reading_device_output, stop_reading_device_output
-import argparse
+from utils import send_cmd, commission_bleThread, CommandError
+from utils.commissioning import CommissioningPipeline, CommissioningWindow
+from utils.commands import FAILURE_PATTERN, RUN_COMMAND_FAILURE, TIMEOUT_PATTERN, chip_tool_cmd, set_chip_tool_storage_dir, set_timeout_handler
+from utils.chip_tool_storage import ChipToolStorage
+from utils.log_finalizer import LogFinalizer, finalize_failure, move_logs
+from utils.perf_baseline import RunMetrics
+from utils.tracing import span, start_tracing, stop_tracing, traced, traced_sleep
+from utils.config import TestConfig, load_config
+from utils.thread_monitor import ThreadNetworkSampler
+from utils.device_resources import DeviceResourceTracker
 import subprocess
-import pexpect
 import datetime
 import sys
 import os
-import json
-from time import sleep
-from typing import Literal, List
-
-discriminator: str = '3840'
-pin: str = '20202021'
-endpointID: str = '1'
-target_device_ip: str = '10.4.215.46'
-toggle_count: int = 0
-single_run_count: int = 0
-multiple_run_count: int = 0
-test_list_run_count: int = 0
-test_plan_run_count: int = 0
-toggle_test_run_count: int = 0
-toggle_sleep_time: int = 1
-commission_device: bool = True
+from time import monotonic, time
+from typing import List, Literal, Optional, Sequence
+
+# pexpect (telnet) and pylink (RTT) are imported where they are used so that runs not needing them start fast.
+
 device_uart_suffix: str = '_device-uart-logs.txt'
 device_rtt_suffix: str = '_device-rtt-logs.txt'
 chip_tool_suffix: str = '_chip-tool-logs.txt'
 device_uart_error_suffix: str = '_device-uart-error-logs.txt'
 device_rtt_error_suffix: str = '_device-rtt-error-logs.txt'
 chip_tool_error_suffix: str = '_chip-tool-error-logs.txt'
-
-env = os.environ.copy()
-
-chip_path = os.path.expanduser('~/connectedhomeip')
-matter_yamltests_path = os.path.join(chip_path, 'scripts', 'py_matter_yamltests')
-matter_idl_path = os.path.join(chip_path, 'scripts', 'py_matter_idl')
-
-existing_pythonpath = os.environ.get("PYTHONPATH", "")
-extra_env_path = f"{matter_yamltests_path}:{matter_idl_path}"
-if existing_pythonpath:
-    extra_env_path = f"{existing_pythonpath}:{extra_env_path}"
-
-def str2bool(value: str) -> bool:
-    """
-    Convert a string representation of truth to a boolean value.
-    Args:
-        value (str): The string to convert. Accepts "yes", "true", "t", "1" for True and "no", "false", "f", "0" for False.
-    Returns:
-        bool: The boolean value.
-    Raises:
-        argparse.ArgumentTypeError: If the string is not a valid boolean representation.
-    """
-    if isinstance(value, bool):
-        return value
-    if value.lower() in ("yes", "true", "t", "1"):
-        return True
-    elif value.lower() in ("no", "false", "f", "0"):
-        return False
-    else:
-        raise argparse.ArgumentTypeError("Boolean value expected.")
-
+thread_network_error_suffix: str = '_thread-network-error-samples.json'
+thread_network_timeout_suffix: str = '_thread-network-timeout-samples.json'
+
+device_resources_suffix: str = '_device-resources.jsonl'
+otbr_error_suffix: str = '_otbr-error-logs.txt'
+error_bundle_suffix: str = '_error-bundle.tar.gz'
+metrics_suffix: str = '_metrics.json'
+trace_suffix: str = '_trace.json'
+
+# tmux session capturing the device logs, suffixed with the worker ID by run() so that parallel workers do not share it
+device_log_session: str = 'chip_tool_test_session'
+# Background Thread network sampler, started by run() when thread_sample_interval > 0
+thread_sampler: Optional[ThreadNetworkSampler] = None
+# Device resource usage tracker, created by run() when track_device_resources is set
+resource_tracker: Optional[DeviceResourceTracker] = None
+# chip-tool storage owned by the run, created by run() when isolate_chip_tool_storage is set
+chip_tool_storage: Optional[ChipToolStorage] = None
+# Background worker finalizing the failed iteration logs, started by run() when background_finalizer is set
+log_finalizer: Optional[LogFinalizer] = None
+# Step durations of the run, compared against the baseline of a previous firmware with utils.perf_baseline
+run_metrics: Optional[RunMetrics] = None
+
+@traced()
 def setup_device_logs(output_file: str, target_ip: str, serial_num: str = ""):
     """
     Setup the device logs. This appends a suffix to the output file to mark it in a way the the error handling function can identify it 
@@ -74,15 +61,17 @@ def setup_device_logs(output_file: str, target_ip: str, serial_num: str = ""):
         target_ip (str): The target device IP address.
         serial_num (str, optional): The serial number of the device. Defaults to "".
     """
-    send_cmd(f'tmux new-session -d -s chip_tool_test_session')
+    send_cmd(f'tmux new-session -d -s {device_log_session}')
     # Screen session to temporary store out logs in uart output_file
     send_cmd(
-        f'tmux send-keys -t chip_tool_test_session "screen -L -Logfile {output_file}{device_uart_suffix} //telnet {target_ip} 4901" C-m')
+        f'tmux send-keys -t {device_log_session} "screen -L -Logfile {output_file}{device_uart_suffix} //telnet {target_ip} 4901" C-m')
     # TODO: Fix/Verify rtt logging before enabling this
     # Start RTT logging
+    # from utils.jlink_logger import start_reading_device_output
     # start_reading_device_output(serial_num=serial_num, log_file_path=f'{output_file}{device_rtt_suffix}')
 
 
+@traced()
 def teardown_device_logs():
     """
     Teardown the device logs.
@@ -90,11 +79,15 @@ def teardown_device_logs():
     1. Kill the tmux session.
     2. Stop reading device output using RTT. (currently disabled)
     """
-    send_cmd('tmux kill-session -t chip_tool_test_session')
+    # Not run through send_cmd: this is bookkeeping, there is no output worth printing or saving
+    subprocess.run(['tmux', 'kill-session', '-t', device_log_session],
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     # TODO: Fix/Verify rtt logging before enabling this
     # Stop RTT logging
+    # from utils.jlink_logger import stop_reading_device_output
     # stop_reading_device_output()
 
+@traced()
 def verify_device_logs(output_file: str) -> bool:
     """
     Verify the device logs are not empty. Empty logs are interpretted as if the device became unresponsive.
@@ -117,6 +110,67 @@ def verify_device_logs(output_file: str) -> bool:
 
     return True  # TODO: Add RTT log verification when implemented
 
+@traced()
+def record_device_resources(series: str, output_file: str):
+    """
+    Record the device resource usage (heap, stacks, sessions, reboots...) reported in the device logs of an iteration.
+    The logs must be complete, i.e. this is called after teardown_device_logs.
+
+    Args:
+        series (str): The series the iteration belongs to, typically the test loop or YAML test name.
+        output_file (str): The output file prefix of the iteration.
+    """
+    if resource_tracker is None:
+        return
+    # The logs of a failed iteration may already have been moved to their error file
+    resource_tracker.record(series, [
+        f'{output_file}{device_uart_suffix}',
+        f'{output_file}{device_uart_error_suffix}',
+        f'{output_file}{device_rtt_suffix}',
+        f'{output_file}{device_rtt_error_suffix}',
+    ])
+
+def record_metric(metric: str, duration: float):
+    """
+    Record the duration of a step in the run metrics (if any).
+
+    Args:
+        metric (str): The metric name, e.g. commissioning.ble_thread.
+        duration (float): The duration in seconds.
+    """
+    if run_metrics is not None:
+        run_metrics.add(metric, duration)
+
+def timed_send_cmd(metric: str, chip_cmd: str, output_file: str):
+    """
+    Run a command with send_cmd and record its duration in the run metrics. As for the commissioning steps, only the
+    successful commands are recorded: a failed or timed out command is not a latency sample.
+
+    Args:
+        metric (str): The metric name.
+        chip_cmd (str): The command to run.
+        output_file (str): The output file of the command.
+
+    Returns:
+        The send_cmd output lines.
+    """
+    start = monotonic()
+    buff = send_cmd(chip_cmd, output_file)
+    if not any(RUN_COMMAND_FAILURE in line for line in buff):
+        record_metric(metric, monotonic() - start)
+    return buff
+
+def prune_chip_tool_storage(node_id: int):
+    """
+    Remove the entries of an unpaired node from the chip-tool storage owned by the run (if any).
+
+    Args:
+        node_id (int): The node ID that was unpaired.
+    """
+    if chip_tool_storage is not None:
+        chip_tool_storage.prune_node(node_id)
+
+@traced()
 def setup_test(otbrhex_input: str, target_ip: str) -> str:
     """
     Setup the test environment on the raspberry pi.
@@ -131,6 +185,8 @@ def setup_test(otbrhex_input: str, target_ip: str) -> str:
     Returns:
         str: The OTBR hex string or "Error" if failed.
     """
+    import pexpect
+
     cmd: str = 'sudo ot-ctl dataset active -x'
 
     if otbrhex_input == '':
@@ -159,13 +215,14 @@ def setup_test(otbrhex_input: str, target_ip: str) -> str:
     child = pexpect.spawn(f'telnet {target_ip} 4902')
     for cmd in telnet_cmds:
         child.sendline(cmd)
-        sleep(0.5)
+        traced_sleep(0.5)
 
     child.close()
 
     return otbrhex_output
 
 
+@traced()
 def teardown_test():
     """
     Teardown the test environment on the raspberry pi.
@@ -177,43 +234,115 @@ def teardown_test():
     #TODO: Verify we want to remove the logs
     #send_cmd('rm -rf /tmp/*')
 
-def factory_reset_device():
+@traced()
+def factory_reset_device(target_ip: str):
     """
     Factory reset the device by:
     1. Opening a telnet session.
     2. Sending the factory reset command.
     3. Closing the telnet session.
+
+    Args:
+        target_ip (str): The target device IP address.
     """
+    import pexpect
+
     telnet_cmds = [
         "device factoryreset",
     ]
 
-    child = pexpect.spawn(f'telnet {target_device_ip} 4901')
+    child = pexpect.spawn(f'telnet {target_ip} 4901')
     for cmd in telnet_cmds:
         child.sendline(cmd)
-        sleep(1)
+        traced_sleep(1)
 
     child.close()
 
-def handle_error(error_code: int, output_file: str):
+@traced()
+def report_command_timeout(output_file: Optional[str], cmd_start: float):
+    """
+    Save the Thread network samples of a chip-tool command that timed out (CHIP Error 0x00000032). Timeouts of the
+    toggle, read and descriptor commands do not fail the iteration, this keeps the mesh state around them anyway.
+    The samples are taken from the buffer right away, the last sample and the report are done by the log finalizer
+    (if running).
+
+    Args:
+        output_file (str): The output file of the command, the report is named after it. Nothing is saved if None.
+        cmd_start (float): Start time (epoch seconds) of the command.
+    """
+    if thread_sampler is None or not output_file:
+        return
+    end = time()
+    prefix = output_file[:-len(chip_tool_suffix)] if output_file.endswith(chip_tool_suffix) else os.path.splitext(output_file)[0]
+    # Several commands of an iteration may time out, keep one report per timeout
+    report_file = f'{prefix}_{int(end)}{thread_network_timeout_suffix}'
+    report_args = (report_file, cmd_start, end, thread_sampler.samples_between(cmd_start, end), True)
+    if log_finalizer is not None:
+        log_finalizer.submit(thread_sampler.write_report, *report_args)
+    else:
+        thread_sampler.write_report(*report_args)
+    print(f'Thread network samples of the timeout saved to {report_file}')
+
+@traced()
+def handle_error(error_code: int, output_file: str, iteration_start: Optional[float] = None):
     """
     Handle a test failure by:
     1. Printing the error code.
-    2. Moving the device logs to the output directory.
-    3. Moving the chip-tool logs to the output directory.
-    4. Calling the teardown_test function.
+    2. Taking the Thread network samples of the failed iteration from the sampler buffer (if the sampler is running).
+    3. Calling the teardown_test function.
+    4. Moving the device and chip-tool logs to their error log files, before the next commands write to these paths.
+    5. Finalizing the logs in the background (or right away if the log finalizer is not running):
+        1. Writing the Thread network samples, with a last sample of the mesh state after the failure.
+        2. Extracting the OTBR logs of the failed iteration.
+        3. Bundling the error logs, OTBR logs and Thread network samples in a compressed archive.
     
     Args:
         error_code (int): The error code from CommandError.
         output_file (str): The output file prefix for log files.
+        iteration_start (float, optional): Start time (epoch seconds) of the failed iteration. Defaults to None.
     """
     print(f'Error: {CommandError.to_string(error_code)}')
-    send_cmd(f'mv {output_file}{device_uart_suffix} {output_file}{device_uart_error_suffix}')
-    # TODO: Fix/Verify rtt logging before enabling this
-    # send_cmd(f'mv {output_file}{device_rtt_suffix} {output_file}{device_rtt_error_suffix}')
-    send_cmd(f'mv {output_file}{chip_tool_suffix} {output_file}{chip_tool_error_suffix}')
+    report_args = None
+    if thread_sampler is not None and iteration_start is not None:
+        # Only the buffer is read here, polling the border router (slow if it is hung) is left to the finalizer
+        end = time()
+        report_args = (f'{output_file}{thread_network_error_suffix}', iteration_start, end,
+                       thread_sampler.samples_between(iteration_start, end), True)
+    # The device logs must be closed before they are moved
     teardown_test()
 
+    error_logs = move_logs([
+        (f'{output_file}{device_uart_suffix}', f'{output_file}{device_uart_error_suffix}'),
+        (f'{output_file}{device_rtt_suffix}', f'{output_file}{device_rtt_error_suffix}'),
+        (f'{output_file}{chip_tool_suffix}', f'{output_file}{chip_tool_error_suffix}'),
+    ])
+    otbr_slice = None
+    if iteration_start is not None:
+        otbr_slice = (f'{output_file}{otbr_error_suffix}', iteration_start, time())
+    finalize_args = (f'{output_file}{error_bundle_suffix}', error_logs + [f'{output_file}{thread_network_error_suffix}'], otbr_slice)
+    if log_finalizer is not None:
+        log_finalizer.submit(finalize_iteration, thread_sampler, report_args, finalize_args)
+    else:
+        finalize_iteration(thread_sampler, report_args, finalize_args)
+
+def finalize_iteration(sampler: Optional[ThreadNetworkSampler], report_args: Optional[tuple], finalize_args: tuple) -> str:
+    """
+    Log finalizer job of a failed iteration: write its Thread network report (if any), then finalize its logs. The
+    report is written first so that it is part of the failure bundle.
+
+    Args:
+        sampler (ThreadNetworkSampler, optional): The sampler of the run.
+        report_args (tuple, optional): The ThreadNetworkSampler.write_report arguments, None to skip the report.
+        finalize_args (tuple): The finalize_failure arguments.
+
+    Returns:
+        str: The failure bundle path.
+    """
+    if sampler is not None and report_args is not None:
+        print(f'Thread network samples of the failed iteration written to {sampler.write_report(*report_args)}')
+    return finalize_failure(*finalize_args)
+
+@traced()
 def toggle_test(
         output_dir: str,
         output_file_prefix: str,
@@ -242,12 +371,14 @@ def toggle_test(
     Returns:
         Literal[0, 1]: CommandError.SUCCESS if there were no error, the failed command error otherwise.
     """
+    import pexpect
+
     device_output_file = output_dir + output_file_prefix + '_toggle_test_'
-    setup_device_logs(device_output_file, target_device_ip, target_device_serial_num)
+    setup_device_logs(device_output_file, target_ip, target_device_serial_num)
     child = pexpect.spawn(f'telnet {target_ip} 4902')
     print('Enabling buttons')
     child.sendline("target button enable")
-    sleep(1)
+    traced_sleep(1)
     for i in range(run_count):
         print(f'Toggle Test Run #{i + 1}')
         telnet_cmds = [
@@ -258,13 +389,14 @@ def toggle_test(
         
         for cmd in telnet_cmds:
             child.sendline(cmd)
-            sleep(0.5)
+            traced_sleep(0.5)
 
-        sleep(sleep_time)
+        traced_sleep(sleep_time)
     teardown_device_logs()
     child.close()
     return CommandError.SUCCESS
 
+@traced()
 def single_fabric_commissioning_test(
         nodeID: int,
         endpointID: str,
@@ -306,39 +438,48 @@ def single_fabric_commissioning_test(
     """
     result = CommandError.SUCCESS
     for i in range(run_count):
-        test_prefix = output_file_prefix + f'_single_run_{i + 1}'
-        output_file = output_dir + test_prefix
-        chip_tool_output_file = output_file + chip_tool_suffix
-
-        setup_device_logs(output_file, target_device_ip)
-        # If this is the first run and the device is commissioned, we skip commissioning.
-        if i != 0 or commission_device:
-            result = commission_bleThread(nodeID+i, otbrhex, pin, discriminator, chip_tool_output_file, chip_tool_path)
-            if result != CommandError.SUCCESS:
-                teardown_device_logs()
-                break
+        with span('single_fabric.iteration', iteration=i + 1, nodeID=nodeID+i, fabric='alpha'):
+            iteration_start = time()
+            test_prefix = output_file_prefix + f'_single_run_{i + 1}'
+            output_file = output_dir + test_prefix
+            chip_tool_output_file = output_file + chip_tool_suffix
+
+            setup_device_logs(output_file, target_device_ip)
+            # If this is the first run and the device is commissioned, we skip commissioning.
+            if i != 0 or commission_device:
+                step_start = monotonic()
+                result = commission_bleThread(nodeID+i, otbrhex, pin, discriminator, chip_tool_output_file, chip_tool_path)
+                if result == CommandError.SUCCESS:
+                    record_metric('commissioning.ble_thread', monotonic() - step_start)
+                if result != CommandError.SUCCESS:
+                    teardown_device_logs()
+                    record_device_resources('single_fabric_commissioning', output_file)
+                    break
         
-        for j in range(0, toggle_count):
-            send_cmd(f'{chip_tool_path} onoff toggle {nodeID+i} {endpointID} --commissioner-name alpha', chip_tool_output_file)
-            send_cmd(f'{chip_tool_path} onoff read on-off {nodeID+i} {endpointID} --commissioner-name alpha', chip_tool_output_file)
+            for j in range(0, toggle_count):
+                timed_send_cmd('onoff.toggle', chip_tool_cmd(chip_tool_path, f'onoff toggle {nodeID+i} {endpointID} --commissioner-name alpha'), chip_tool_output_file)
+                timed_send_cmd('onoff.read', chip_tool_cmd(chip_tool_path, f'onoff read on-off {nodeID+i} {endpointID} --commissioner-name alpha'), chip_tool_output_file)
 
 
-        send_cmd(f'{chip_tool_path} descriptor read device-type-list {nodeID+i} 0xFFFF', chip_tool_output_file)
-        send_cmd(f'{chip_tool_path} descriptor read server-list {nodeID+i} 0', chip_tool_output_file)
-        send_cmd(f'{chip_tool_path} descriptor read server-list {nodeID+i} 1', chip_tool_output_file)
-        send_cmd(f'{chip_tool_path} accesscontrol read feature-map {nodeID+i} 0', chip_tool_output_file)
-        send_cmd(f'{chip_tool_path} pairing unpair {nodeID+i} --commissioner-name alpha', chip_tool_output_file)
-        #factory_reset_device()
-        teardown_device_logs()
+            timed_send_cmd('descriptor.read', chip_tool_cmd(chip_tool_path, f'descriptor read device-type-list {nodeID+i} 0xFFFF'), chip_tool_output_file)
+            timed_send_cmd('descriptor.read', chip_tool_cmd(chip_tool_path, f'descriptor read server-list {nodeID+i} 0'), chip_tool_output_file)
+            timed_send_cmd('descriptor.read', chip_tool_cmd(chip_tool_path, f'descriptor read server-list {nodeID+i} 1'), chip_tool_output_file)
+            timed_send_cmd('accesscontrol.read', chip_tool_cmd(chip_tool_path, f'accesscontrol read feature-map {nodeID+i} 0'), chip_tool_output_file)
+            timed_send_cmd('unpair', chip_tool_cmd(chip_tool_path, f'pairing unpair {nodeID+i} --commissioner-name alpha'), chip_tool_output_file)
+            prune_chip_tool_storage(nodeID+i)
+            #factory_reset_device()
+            teardown_device_logs()
+            record_device_resources('single_fabric_commissioning', output_file)
 
 
     if result != CommandError.SUCCESS:
         print(f'Single Fabric Commissioning Test Error #{i + 1}: {CommandError.to_string(result)}')
-        handle_error(result, output_file)
+        handle_error(result, output_file, iteration_start)
     
     return result
 
 
+@traced()
 def multiple_fabric_commissioning_test(
         nodeID: int,
         endpointID: str,
@@ -351,7 +492,9 @@ def multiple_fabric_commissioning_test(
         run_count: int,
         commission_device: bool,
         toggle_count: int = 1,
-        chip_tool_path: str = "~/connectedhomeip/out/standalone/chip-tool"
+        chip_tool_path: str = "~/connectedhomeip/out/standalone/chip-tool",
+        window: Optional[CommissioningWindow] = None,
+        persistent_controller_session: bool = False
     ) -> Literal[0,1,2,3]:
     """
     Perform multiple fabric commissioning tests.
@@ -379,60 +522,76 @@ def multiple_fabric_commissioning_test(
         commission_device (bool): Whether to commission the device.
         toggle_count (int, optional): The number of times to toggle the device on and off for each fabric. Defaults to 2.
         chip_tool_path (str, optional): The path to the chip-tool binary. Defaults to "~/connectedhomeip/out/standalone/chip-tool".
+        window (CommissioningWindow, optional): The commissioning window opened to add each fabric. Defaults to a
+            window opened on nodeID with the chip-tool example parameters.
+        persistent_controller_session (bool, optional): Whether to open the window and pair in one chip-tool
+            interactive session. Defaults to False.
 
     Returns:
         Literal[0,1,2,3]: CommandError.SUCCESS if there were no error, the failed command error otherwise.
     """
+    if window is None:
+        window = CommissioningWindow(node_id=nodeID)
     result = CommandError.SUCCESS
     fabric_names = {1: 'alpha', 2: 'beta', 3: 'gamma', 4: 4, 5: 5}
     for i in range(run_count):
-        test_prefix = output_file_prefix + f'_multiple_run_{i + 1}'
-        output_file = output_dir + test_prefix
-        chip_tool_output_file = output_file + chip_tool_suffix
+        with span('multiple_fabric.iteration', iteration=i + 1, nodeID=nodeID):
+            iteration_start = time()
+            test_prefix = output_file_prefix + f'_multiple_run_{i + 1}'
+            output_file = output_dir + test_prefix
+            chip_tool_output_file = output_file + chip_tool_suffix
+
+            setup_device_logs(output_file, target_device_ip)
+            # If this is the first run and the device is commissioned, we skip commissioning.
+            if i != 0 or commission_device:
+                step_start = monotonic()
+                result = commission_bleThread(nodeID, otbrhex, pin, discriminator, chip_tool_output_file, chip_tool_path)
+                if result == CommandError.SUCCESS:
+                    record_metric('commissioning.ble_thread', monotonic() - step_start)
+                if result != CommandError.SUCCESS:
+                    teardown_device_logs()
+                    record_device_resources('multiple_fabric_commissioning', output_file)
+                    break
+
+            # Commission additional fabrics
+            with CommissioningPipeline(chip_tool_path, chip_tool_output_file, window, persistent_controller_session) as pipeline:
+                for fabric_idx, fabric_name in fabric_names.items():
+                    if fabric_idx == 1:
+                        continue
+                    with span('multiple_fabric.add_fabric', nodeID=fabric_idx, fabric=fabric_name):
+                        result, timings = pipeline.add_fabric(fabric_idx, fabric_name)
+                        for step, duration in timings.items():
+                            record_metric(f'commissioning.{step}', duration)
+                        if result != CommandError.SUCCESS:
+                            break
 
-        setup_device_logs(output_file, target_device_ip)
-        # If this is the first run and the device is commissioned, we skip commissioning.
-        if i != 0 or commission_device:
-            result = commission_bleThread(nodeID, otbrhex, pin, discriminator, chip_tool_output_file, chip_tool_path)
             if result != CommandError.SUCCESS:
                 teardown_device_logs()
+                record_device_resources('multiple_fabric_commissioning', output_file)
                 break
 
-        # Commission additional fabrics
-        for fabric_idx, fabric_name in fabric_names.items():
-            if fabric_idx == 1:
-                continue
-            pairing_code = open_commissioning_window(chip_tool_output_file)
-            if CommandError.OPEN_COMMISSIONING_WINDOW_ERROR == pairing_code:
-                result = CommandError.OPEN_COMMISSIONING_WINDOW_ERROR
-                break
-            if CommandError.COMMISSION_PAIRING_CODE_ERROR == commission_pairing_code(pairing_code, fabric_idx, fabric_name, chip_tool_output_file):
-                result = CommandError.COMMISSION_PAIRING_CODE_ERROR
-                break
-
-        if result != CommandError.SUCCESS:
-            teardown_device_logs()
-            break
-
-        # Toggle and read on-off state for each fabric
-        for fabric_idx, fabric_name in fabric_names.items():
-            for j in range(0, toggle_count):
-                send_cmd(f'{chip_tool_path} onoff toggle {fabric_idx} {endpointID} --commissioner-name {fabric_name}', chip_tool_output_file)
-                send_cmd(f'{chip_tool_path} onoff read on-off {fabric_idx} {endpointID} --commissioner-name {fabric_name}', chip_tool_output_file)
+            # Toggle and read on-off state for each fabric
+            for fabric_idx, fabric_name in fabric_names.items():
+                for j in range(0, toggle_count):
+                    timed_send_cmd('onoff.toggle', chip_tool_cmd(chip_tool_path, f'onoff toggle {fabric_idx} {endpointID} --commissioner-name {fabric_name}'), chip_tool_output_file)
+                    timed_send_cmd('onoff.read', chip_tool_cmd(chip_tool_path, f'onoff read on-off {fabric_idx} {endpointID} --commissioner-name {fabric_name}'), chip_tool_output_file)
 
-        # Unpair each fabric in reverse order
-        for fabric_idx, fabric_name in reversed(fabric_names.items()):
-            send_cmd(f'{chip_tool_path} pairing unpair {fabric_idx} --commissioner-name {fabric_name}', chip_tool_output_file)
+            # Unpair each fabric in reverse order
+            for fabric_idx, fabric_name in reversed(fabric_names.items()):
+                timed_send_cmd('unpair', chip_tool_cmd(chip_tool_path, f'pairing unpair {fabric_idx} --commissioner-name {fabric_name}'), chip_tool_output_file)
+                prune_chip_tool_storage(fabric_idx)
 
-        teardown_device_logs()
+            teardown_device_logs()
+            record_device_resources('multiple_fabric_commissioning', output_file)
 
     if result != CommandError.SUCCESS:
         print(f'Multiple Fabric Commissioning Test Error #{i + 1}: {CommandError.to_string(result)}')
-        handle_error(result, output_file)
+        handle_error(result, output_file, iteration_start)
 
     return result
 
 
+@traced()
 def yaml_test_script_test(
     nodeID: int,
     otbrhex: str,
@@ -475,17 +634,23 @@ def yaml_test_script_test(
         chip_tool_path (str, optional): The path to the chip-tool binary. Defaults to "~/connectedhomeip/out/standalone/chip-tool".
         
     Returns:
-        Literal[0,1,2,3,4,5]: CommandError.SUCCESS if all tests pass, otherwise the error code.
+        Literal[0,1,2,3,4,5]: CommandError.SUCCESS if all tests pass, otherwise the error code. A failed test does not
+        stop the loop, CommandError.TEST_FAILURE is returned once the device is unpaired.
     """
     result = CommandError.SUCCESS
+    failed_runs = 0
 
     if commission_device:
+        iteration_start = time()
         output_file = output_dir + output_file_prefix + "_test_plan_run_commissioning"
         chip_tool_output_file = output_file + chip_tool_suffix
+        step_start = monotonic()
         result = commission_bleThread(nodeID, otbrhex, pin, discriminator, chip_tool_output_file, chip_tool_path)
+        if result == CommandError.SUCCESS:
+            record_metric('commissioning.ble_thread', monotonic() - step_start)
         if result != CommandError.SUCCESS:
             print(f'Commissioning failed with error: {result}')
-            handle_error(result, output_file)
+            handle_error(result, output_file, iteration_start)
             return result
 
     for i in range(test_list_run_count):
@@ -495,25 +660,36 @@ def yaml_test_script_test(
         for test in test_list:
             print(f'Running test: {test}')
             for j in range(test_plan_run_count):  # Run each yaml test plan 3 times
-                device_output_file = output_file + test + f'_run_{j + 1}'
-                chip_tool_output_file = output_file + test + f'_run_{j + 1}' +  chip_tool_suffix
-                setup_device_logs(device_output_file, target_device_ip, target_device_serial_num)
-                buff = send_cmd(
-                    chip_cmd=f'python3 {chip_path}/scripts/tests/chipyaml/chiptool.py tests {test} --server_path {chip_tool_path} --nodeId {nodeID}',
-                    output_file=chip_tool_output_file,
-                    extra_env_path=extra_env_path,
-                    cwd=chip_path
-                )
-                if not verify_device_logs(device_output_file):
-                    handle_error(CommandError.DEVICE_UNRESPONSIVE, device_output_file)
-                    result = CommandError.DEVICE_UNRESPONSIVE
-                    break
-                else:
-                    for line in reversed(buff):
-                        if "########## FAILURE ##########" in line:
-                            handle_error(CommandError.TEST_FAILURE, device_output_file)
-                            # If a failure is detected, we identify the failure logs but we don't stop the test run.
-                teardown_device_logs()
+                with span('yaml.test', test=test, run=j + 1, nodeID=nodeID):
+                    iteration_start = time()
+                    device_output_file = output_file + test + f'_run_{j + 1}'
+                    chip_tool_output_file = output_file + test + f'_run_{j + 1}' +  chip_tool_suffix
+                    setup_device_logs(device_output_file, target_device_ip, target_device_serial_num)
+                    chip_cmd = f'python3 {chip_path}/scripts/tests/chipyaml/chiptool.py tests {test} --server_path {chip_tool_path} --nodeId {nodeID}'
+                    if chip_tool_storage is not None:
+                        chip_cmd += f' --server_arguments "interactive server --storage-directory {chip_tool_storage.path}"'
+                    step_start = monotonic()
+                    buff = send_cmd(
+                        chip_cmd=chip_cmd,
+                        output_file=chip_tool_output_file,
+                        extra_env_path=extra_env_path,
+                        cwd=chip_path
+                    )
+                    duration = monotonic() - step_start
+                    test_failed = any(FAILURE_PATTERN.search(line) for line in buff)
+                    device_responsive = verify_device_logs(device_output_file)
+                    teardown_device_logs()
+                    record_device_resources(test, device_output_file)
+                    if not device_responsive:
+                        handle_error(CommandError.DEVICE_UNRESPONSIVE, device_output_file, iteration_start)
+                        result = CommandError.DEVICE_UNRESPONSIVE
+                        break
+                    if test_failed:
+                        # If a failure is detected, we identify the failure logs but we don't stop the test run.
+                        failed_runs += 1
+                        handle_error(CommandError.TEST_FAILURE, device_output_file, iteration_start)
+                    elif not any(TIMEOUT_PATTERN.search(line) for line in buff):
+                        record_metric(f'yaml.{test}', duration)
 
             if result != CommandError.SUCCESS:
                 break
@@ -522,7 +698,11 @@ def yaml_test_script_test(
         
     # Unpair after all tests if commissioning succeeded
     if result == CommandError.SUCCESS:
-        send_cmd(f'{chip_tool_path} pairing unpair {nodeID} --commissioner-name alpha', chip_tool_output_file)
+        timed_send_cmd('unpair', chip_tool_cmd(chip_tool_path, f'pairing unpair {nodeID} --commissioner-name alpha'), chip_tool_output_file)
+        prune_chip_tool_storage(nodeID)
+        if failed_runs:
+            print(f'YAML Test Script Test Error: {failed_runs} failed test run(s)')
+            result = CommandError.TEST_FAILURE
     else:
         # TODO: Add error handling to recover the device if it is unresponsive
         print(f'YAML Test Script Test Error: {CommandError.to_string(result)}')
@@ -530,166 +710,250 @@ def yaml_test_script_test(
     return result
 
 
-if __name__ == '__main__':
-    output_dir: str = './test_logs/'
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """
+    Run the test plans selected by the configuration.
+
+    Args:
+        argv (Sequence[str], optional): The CLI arguments, defaults to sys.argv[1:].
+
+    Returns:
+        int: 0 if every test plan passed, -1 otherwise.
+    """
+    config: TestConfig = load_config(argv)
+    return run(config)
+
+
+def run(config: TestConfig) -> int:
+    """
+    Run the test plans selected by an already resolved configuration.
+    Steps:
+    1. Start tracing the run (if trace is set).
+    2. Factory reset the device (if requested).
+    3. Setup the test environment.
+    4. Create the chip-tool storage of the run (if isolate_chip_tool_storage is set).
+    5. Start the Thread network sampler (if thread_sample_interval > 0), the device resource tracker and the log
+       finalizer.
+    6. Run the test plans.
+    7. Stop the Thread network sampler, wait for the log finalizer, print the device resource trends, save the run
+       metrics and remove the chip-tool storage.
+    8. Export the run trace.
+
+    Args:
+        config (TestConfig): The test configuration.
+
+    Returns:
+        int: 0 if every test plan passed, -1 otherwise.
+    """
+    global device_log_session
 
     # Ensure output directories exist
-    os.makedirs(output_dir, exist_ok=True)
-
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--chip_path', type=str, required=False, default=chip_path)
-    parser.add_argument('--otbrhex', type=str, required=False)
-    parser.add_argument('--discriminator', type=str, required=False)
-    parser.add_argument('--pin', type=str, required=False)
-    parser.add_argument('--nodeID', type=int, required=False)
-    parser.add_argument('--endpointID', type=str, required=False)
-    parser.add_argument('--target_device_ip', type=str, required=False)
-    parser.add_argument('--target_device_serial_num', type=str, required=False)
-    parser.add_argument('--test_list', type=str, required=False)
-    parser.add_argument('--use_json_list', type=str2bool, required=False, default=False)
-    parser.add_argument('--single_run_count', type=int, required=False)
-    parser.add_argument('--multiple_run_count', type=int, required=False)
-    parser.add_argument('--test_list_run_count', type=int, required=False)
-    parser.add_argument('--test_plan_run_count', type=int, required=False)
-    parser.add_argument('--toggle_test_run_count', type=int, required=False)
-    parser.add_argument('--toggle_sleep_time', type=int, required=False)
-    parser.add_argument('--factory_reset_device', type=str2bool, required=False, default=False)
-    parser.add_argument('--commission_device', type=str2bool, required=False, default=False)
-    parser.add_argument('--use_script_input_json', type=str2bool, required=False, default=False)
-    args = parser.parse_args()
-
-    # Load from script_input.json if requested
-    if 'use_script_input_json' in vars(args) and args.use_script_input_json:
-        with open('script_input.json', 'r') as f:
-            json_args = json.load(f)
-        # Override args with json_args
-        for k, v in json_args.items():
-            # Convert test_list to comma-separated string for compatibility
-            if k == "test_list" and isinstance(v, list):
-                setattr(args, k, ",".join(v))
-            else:
-                setattr(args, k, v)
-
-    otbrhex: str = ""
+    os.makedirs(config.output_dir, exist_ok=True)
+
     # output file prefix based on date
     output_file_prefix = str(datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S"))
+    if config.worker_id:
+        # Workers started in the same second must not share their logs nor their device log session
+        output_file_prefix += f'_{config.worker_id}'
+        device_log_session = f'chip_tool_test_session_{config.worker_id}'
+    if config.trace:
+        start_tracing()
+    try:
+        with span('run', firmware=config.firmware_label, target_device_ip=config.target_device_ip):
+            return run_with_tracing(config, output_file_prefix)
+    finally:
+        if config.trace:
+            trace_file = config.output_dir + output_file_prefix + trace_suffix
+            stop_tracing(trace_file)
+            print(f'Run trace written to {trace_file}')
+
+
+def run_with_tracing(config: TestConfig, output_file_prefix: str) -> int:
+    """
+    Body of run(), executed inside the run span once tracing has been started.
 
-    if 'chip_path' in vars(args) and args.chip_path:
-        chip_path = args.chip_path
-    if 'otbrhex' in vars(args) and args.otbrhex:
-        otbrhex = args.otbrhex
-    if 'discriminator' in vars(args) and args.discriminator:
-        discriminator = args.discriminator
-    if 'pin' in vars(args) and args.pin:
-        pin = args.pin
-    if 'nodeID' in vars(args) and args.nodeID is not None:
-        nodeID = args.nodeID
-    if 'endpointID' in vars(args) and args.endpointID:
-        endpointID = args.endpointID
-    if 'target_device_ip' in vars(args) and args.target_device_ip:
-        target_device_ip = args.target_device_ip
-    if 'target_device_serial_num' in vars(args) and args.target_device_serial_num:
-        target_device_serial_num = args.target_device_serial_num
-    if 'commission_device' in vars(args):
-        commission_device = args.commission_device
-    if 'single_run_count' in vars(args) and args.single_run_count is not None:
-        single_run_count = args.single_run_count
-    if 'multiple_run_count' in vars(args) and args.multiple_run_count is not None:
-        multiple_run_count = args.multiple_run_count
-    if 'test_list_run_count' in vars(args) and args.test_list_run_count is not None:
-        test_list_run_count = args.test_list_run_count
-    if 'test_plan_run_count' in vars(args) and args.test_plan_run_count is not None:
-        test_plan_run_count = args.test_plan_run_count
-    if 'toggle_test_run_count' in vars(args) and args.toggle_test_run_count is not None:
-        toggle_test_run_count = args.toggle_test_run_count
-    if 'toggle_sleep_time' in vars(args) and args.toggle_sleep_time is not None:
-        toggle_sleep_time = args.toggle_sleep_time
-    if 'factory_reset_device' in vars(args) and args.factory_reset_device:
+    Args:
+        config (TestConfig): The test configuration.
+        output_file_prefix (str): The output file prefix (typically the time when the test were started).
+
+    Returns:
+        int: 0 if every test plan passed, -1 otherwise.
+    """
+    global thread_sampler, resource_tracker, chip_tool_storage, log_finalizer, run_metrics
+
+    if config.isolate_chip_tool_storage:
+        chip_tool_storage = ChipToolStorage(
+            config.chip_tool_storage_base,
+            config.chip_tool_storage_template,
+            config.worker_id
+        )
+        # A run reusing the commissioning of a previous run needs its commissioner identities, fail before touching
+        # the device if the template does not hold them
+        if not config.commission_device and not chip_tool_storage.has_template_configuration():
+            print(f'Error: the chip-tool storage template ({config.chip_tool_storage_template or "none"}) holds no '
+                  f'chip_tool_config*.ini, the device commissioned by a previous run cannot be controlled. Prepare a '
+                  f'template with "python3 -m utils.chip_tool_storage <template_dir>" and pass it with '
+                  f'--chip_tool_storage_template, or run with --isolate_chip_tool_storage False.')
+            chip_tool_storage = None
+            return -1
+
+    if config.factory_reset_device:
         print("Factory resetting device...")
-        factory_reset_device() 
+        factory_reset_device(config.target_device_ip)
+
+    otbrhex = setup_test(config.otbrhex, config.target_device_ip)
 
-    test_list = []
-    if 'use_json_list' in vars(args) and args.use_json_list:
-        with open("yaml_test_list.json", "r") as f:
-            jsonData = json.load(f)
-            test_list = jsonData.get("YamlTestCasesToRun", [])
-    elif 'test_list' in vars(args) and args.test_list:
-        if isinstance(args.test_list, str):
-            test_list = [t.strip() for t in args.test_list.split(',') if t.strip()]
+    if chip_tool_storage is not None:
+        set_chip_tool_storage_dir(chip_tool_storage.create())
+        print(f'chip-tool storage: {chip_tool_storage.path}')
 
-    otbrhex = setup_test(otbrhex, target_device_ip)
-    chip_tool_path = chip_path + '/out/standalone/chip-tool'
+    if config.track_device_resources:
+        resource_tracker = DeviceResourceTracker(
+            config.output_dir + output_file_prefix + device_resources_suffix,
+            leak_threshold=config.leak_threshold,
+            min_iterations=config.leak_min_iterations
+        )
+    run_metrics = RunMetrics(config.firmware_label)
+    if config.thread_sample_interval > 0:
+        thread_sampler = ThreadNetworkSampler(config.thread_sample_interval, config.thread_sample_buffer_size)
+        thread_sampler.start()
+        set_timeout_handler(report_command_timeout)
+    if config.background_finalizer:
+        log_finalizer = LogFinalizer()
+        log_finalizer.start()
+    try:
+        return run_test_plans(config, otbrhex, output_file_prefix)
+    finally:
+        if thread_sampler is not None:
+            set_timeout_handler(None)
+            thread_sampler.stop()
+            thread_sampler = None
+        if log_finalizer is not None:
+            # Wait for the pending failure bundles before exiting
+            log_finalizer.stop()
+            log_finalizer = None
+        if resource_tracker is not None:
+            for series, trends in resource_tracker.summary().items():
+                print(f'Device resource trends ({series}, per iteration): {trends}')
+            resource_tracker = None
+        if run_metrics is not None:
+            metrics_file = config.output_dir + output_file_prefix + metrics_suffix
+            run_metrics.save(metrics_file)
+            print(f'Run metrics written to {metrics_file}')
+            run_metrics = None
+        if chip_tool_storage is not None:
+            set_chip_tool_storage_dir(None)
+            chip_tool_storage.cleanup()
+            chip_tool_storage = None
+
+
+def run_test_plans(config: TestConfig, otbrhex: str, output_file_prefix: str) -> int:
+    """
+    Run the single fabric, multiple fabric, YAML and toggle test loops with a non-zero run count, then teardown the
+    test environment.
+
+    Args:
+        config (TestConfig): The test configuration.
+        otbrhex (str): The OTBR hex string.
+        output_file_prefix (str): The output file prefix (typically the time when the test were started).
 
-    if single_run_count > 0:
+    Returns:
+        int: 0 if every test plan passed, -1 otherwise.
+    """
+    output_dir = config.output_dir
+    commission_device = config.commission_device
+    test_failures = False
+    test_list = config.resolve_test_list()
+    chip_tool_path = config.chip_tool_path
+
+    if config.single_run_count > 0:
         result = single_fabric_commissioning_test(
-            nodeID, 
-            endpointID, 
-            otbrhex, 
-            pin, 
-            discriminator, 
-            output_dir, 
+            config.nodeID,
+            config.endpointID,
+            otbrhex,
+            config.pin,
+            config.discriminator,
+            output_dir,
             output_file_prefix,
-            target_device_ip, 
-            single_run_count,
+            config.target_device_ip,
+            config.single_run_count,
             commission_device,
-            toggle_count=toggle_count
+            toggle_count=config.toggle_count,
+            chip_tool_path=chip_tool_path
         )
         if result != CommandError.SUCCESS:
-            exit(-1)
+            return -1
         # if we didn't fail, we unpaired the device so we need to set commission_device to True for the next test
         commission_device = True
-    if multiple_run_count > 0 and not commission_device:
+    if config.multiple_run_count > 0 and not commission_device:
         result = multiple_fabric_commissioning_test(
-            nodeID, 
-            endpointID, 
-            otbrhex, 
-            pin, 
-            discriminator, 
-            output_dir, 
+            config.nodeID,
+            config.endpointID,
+            otbrhex,
+            config.pin,
+            config.discriminator,
+            output_dir,
             output_file_prefix,
-            target_device_ip, 
-            multiple_run_count,
+            config.target_device_ip,
+            config.multiple_run_count,
             commission_device,
-            toggle_count=toggle_count
+            toggle_count=config.toggle_count,
+            chip_tool_path=chip_tool_path,
+            window=CommissioningWindow(
+                node_id=config.nodeID,
+                option=config.commissioning_window_option,
+                timeout=config.commissioning_window_timeout,
+                iterations=config.commissioning_window_iterations,
+                discriminator=config.commissioning_window_discriminator
+            ),
+            persistent_controller_session=config.persistent_controller_session
         )
         if result != CommandError.SUCCESS:
-            exit(-1)
-            # if we didn't fail, we unpaired the device so we need to set commission_device to True for the next test
+            return -1
+        # if we didn't fail, we unpaired the device so we need to set commission_device to True for the next test
         commission_device = True
 
-    if test_plan_run_count >= 1:
+    if config.test_plan_run_count >= 1:
         result = yaml_test_script_test(
-            nodeID=nodeID,
+            nodeID=config.nodeID,
             otbrhex=otbrhex,
-            pin=pin,
-            discriminator=discriminator,
-            chip_path=chip_path,
+            pin=config.pin,
+            discriminator=config.discriminator,
+            chip_path=config.chip_path,
             commission_device=commission_device,
             chip_tool_path=chip_tool_path,
             output_dir=output_dir,
             output_file_prefix=output_file_prefix,
             test_list=test_list,
-            test_list_run_count=test_list_run_count,
-            test_plan_run_count=test_plan_run_count,
-            target_device_ip=target_device_ip,
-            target_device_serial_num=target_device_serial_num if 'target_device_serial_num' in locals() else "",
-            extra_env_path=extra_env_path
+            test_list_run_count=config.test_list_run_count,
+            test_plan_run_count=config.test_plan_run_count,
+            target_device_ip=config.target_device_ip,
+            target_device_serial_num=config.target_device_serial_num,
+            extra_env_path=config.extra_env_path
         )
-        if result != CommandError.SUCCESS:
-            exit(-1)
+        if result == CommandError.TEST_FAILURE:
+            # The device was unpaired after the failed tests, the next test plans can still run
+            test_failures = True
+        elif result != CommandError.SUCCESS:
+            return -1
         # if we didn't fail, we unpaired the device so we need to set commission_device to True for the next test
         commission_device = True
 
-    if toggle_test_run_count >= 1:
+    if config.toggle_test_run_count >= 1:
         result = toggle_test(
             output_dir=output_dir,
             output_file_prefix=output_file_prefix,
-            target_ip=target_device_ip,
-            target_device_serial_num=target_device_serial_num if 'target_device_serial_num' in locals() else "",
-            run_count=toggle_test_run_count,
-            sleep_time=toggle_sleep_time
+            target_ip=config.target_device_ip,
+            target_device_serial_num=config.target_device_serial_num,
+            run_count=config.toggle_test_run_count,
+            sleep_time=config.toggle_sleep_time
         )
         if result != CommandError.SUCCESS:
-            exit(-1)
+            return -1
 
     teardown_test()
+    return -1 if test_failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,2 @@
+#!/bin/bash
+python3 -m utils.log_analysis ./test_logs/ --yaml_test_list yaml_test_list.json "$@"
@@ -1,2 +1,17 @@
 from .commands import send_cmd, open_commissioning_window, commission_pairing_code, commission_bleThread, CommandError
-from .jlink_logger import start_reading_device_output, stop_reading_device_output
+from .config import TestConfig, load_config, str2bool
+from .thread_monitor import ThreadNetworkSampler
+
+# The RTT logger pulls in pylink, only load it when it is actually used.
+_LAZY_ATTRS = {
+    'start_reading_device_output': 'jlink_logger',
+    'stop_reading_device_output': 'jlink_logger',
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRS:
+        import importlib
+        module = importlib.import_module(f'.{_LAZY_ATTRS[name]}', __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,112 @@
+import os
+from typing import List, Optional, Tuple
+
+from .commands import chip_tool_cmd
+from .tracing import span
+
+INTERACTIVE_PROMPT = '>>> '
+START_TIMEOUT = 30
+
+
+class ChipToolSession:
+    """
+    Persistent chip-tool controller session (chip-tool interactive mode).
+
+    The commands share one chip-tool process, so the stack initialization, storage loading and CASE sessions are done
+    once instead of once per command, and a command can be sent as soon as the output of the previous one holds what
+    is needed (e.g. the pairing code), while chip-tool finishes it.
+    """
+
+    def __init__(self, chip_tool_path: str, output_file: str):
+        """
+        Args:
+            chip_tool_path (str): The path to the chip-tool binary.
+            output_file (str): The file the session output is appended to.
+        """
+        # chip-tool is not started through a shell, "~" would not be expanded
+        self.chip_tool_path = os.path.expanduser(chip_tool_path)
+        self.output_file = output_file
+        self._child = None
+        self._log = None
+
+    def start(self) -> bool:
+        """
+        Start chip-tool in interactive mode (closing the previous session, if any) and wait for its prompt.
+
+        Returns:
+            bool: True if the session is ready, False if chip-tool could not be started.
+        """
+        import pexpect
+
+        self.close()
+        self._log = open(self.output_file, 'a')
+        with span('chip-tool interactive start') as session_span:
+            try:
+                self._child = pexpect.spawn(chip_tool_cmd(self.chip_tool_path, 'interactive start'),
+                                            encoding='utf-8', codec_errors='replace', maxread=65536)
+                self._child.logfile_read = self._log
+                session_span.set('pid', self._child.pid)
+                self._child.expect_exact(INTERACTIVE_PROMPT, timeout=START_TIMEOUT)
+            except pexpect.ExceptionPexpect as e:
+                print(f'Failed to start the chip-tool interactive session: {e}')
+                session_span.set('error', type(e).__name__)
+                self.close()
+                return False
+        return True
+
+    def close(self):
+        if self._child is not None:
+            if self._child.isalive():
+                self._child.sendline('quit')
+            self._child.close(force=True)
+            self._child = None
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def __enter__(self) -> 'ChipToolSession':
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def alive(self) -> bool:
+        return self._child is not None and self._child.isalive()
+
+    def run(self, command: str, patterns: List[str], timeout: float) -> Tuple[Optional[int], List[str]]:
+        """
+        Send a command and wait for the first of the given regex patterns in its output.
+
+        Args:
+            command (str): The chip-tool command, without the chip-tool path (e.g. "pairing code 2 1234").
+            patterns (List[str]): The regex patterns ending the wait.
+            timeout (float): Time in seconds to wait for a pattern.
+
+        Returns:
+            Tuple[Optional[int], List[str]]: The index of the matched pattern (None on timeout, if chip-tool exited or
+            if the session is not started) and the output lines up to and including the match.
+        """
+        import pexpect
+
+        if not self.alive:
+            return None, []
+        print(f'===== session cmd: {command}')
+        with span(f'chip-tool interactive {" ".join(command.split()[:2])}', command=command,
+                  pid=self._child.pid) as cmd_span:
+            try:
+                self._child.sendline(command)
+                index = self._child.expect(patterns + [pexpect.TIMEOUT, pexpect.EOF], timeout=timeout)
+                output = self._child.before + (self._child.after if isinstance(self._child.after, str) else '')
+                # The match is on a partial line, read the rest of it
+                if index < len(patterns):
+                    self._child.expect([r'\r?\n', pexpect.TIMEOUT, pexpect.EOF], timeout=1)
+                    output += self._child.before
+            except (pexpect.ExceptionPexpect, OSError) as e:
+                # e.g. chip-tool exited while the command was sent
+                print(f'chip-tool interactive session failed: {e}')
+                cmd_span.set('error', type(e).__name__)
+                return None, []
+            cmd_span.set('matched', index if index < len(patterns) else None)
+        return (index if index < len(patterns) else None), output.splitlines()
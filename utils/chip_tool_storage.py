@@ -0,0 +1,125 @@
+import argparse
+import glob
+import os
+import shutil
+import tempfile
+from typing import List, Optional
+
+# tmpfs mount available on Linux (and on the Raspberry Pi OS), storage I/O there does not touch the SD card.
+DEFAULT_STORAGE_BASE = '/dev/shm/chip-tool-automation'
+# chip-tool default storage, used as template when no prepared one is given.
+DEFAULT_TEMPLATE_DIR = tempfile.gettempdir()
+STORAGE_FILE_PATTERNS = ('chip_tool_config*.ini', 'chip_tool_kvs', 'chip_tool_history')
+
+
+def storage_files(directory: str) -> List[str]:
+    """
+    List the chip-tool storage files of a directory.
+    """
+    files = []
+    for pattern in STORAGE_FILE_PATTERNS:
+        files.extend(p for p in glob.glob(os.path.join(directory, pattern)) if os.path.isfile(p))
+    return sorted(files)
+
+
+def prepare_template(template_dir: str, source_dir: str = DEFAULT_TEMPLATE_DIR) -> List[str]:
+    """
+    Create a storage template from an existing chip-tool storage (e.g. after the commissioner identities of every
+    fabric have been generated).
+
+    Returns:
+        List[str]: The files copied to the template.
+    """
+    os.makedirs(template_dir, exist_ok=True)
+    copied = []
+    for path in storage_files(source_dir):
+        copied.append(shutil.copy2(path, template_dir))
+    return copied
+
+
+class ChipToolStorage:
+    """
+    chip-tool storage directory owned by a run (or a worker), on tmpfs when available.
+
+    The directory is seeded from a template holding the fabric and commissioner identities so that the devices
+    commissioned with that template can still be controlled, and is passed to chip-tool with --storage-directory.
+    """
+
+    def __init__(self, base_dir: str = DEFAULT_STORAGE_BASE, template_dir: str = DEFAULT_TEMPLATE_DIR,
+                 worker_id: str = ''):
+        """
+        Args:
+            base_dir (str, optional): The directory the storage directories are created in. Falls back to the
+                system temporary directory if its parent does not exist.
+            template_dir (str, optional): The directory the storage is seeded from, it must hold a chip-tool
+                configuration. '' to start from an empty storage.
+            worker_id (str, optional): Identifier of the run or worker, defaults to the process ID.
+        """
+        if not os.path.isdir(os.path.dirname(base_dir.rstrip('/'))):
+            base_dir = os.path.join(tempfile.gettempdir(), os.path.basename(base_dir.rstrip('/')))
+        self.base_dir = base_dir
+        self.template_dir = template_dir
+        self.worker_id = worker_id or str(os.getpid())
+        self.path: Optional[str] = None
+
+    def has_template_configuration(self) -> bool:
+        """
+        Whether the template holds a chip-tool configuration (chip_tool_config*.ini), i.e. the fabric and commissioner
+        identities needed to control the devices commissioned with it.
+        """
+        return bool(self.template_dir) and bool(glob.glob(os.path.join(self.template_dir, 'chip_tool_config*.ini')))
+
+    def create(self) -> str:
+        """
+        Create the storage directory and seed it from the template.
+
+        Returns:
+            str: The storage directory path.
+        """
+        if not self.has_template_configuration():
+            print(f'chip-tool storage: no chip-tool configuration in the template ({self.template_dir or "none"}), '
+                  f'starting from an empty storage. The commissioner identities generated by the run are removed with '
+                  f'it at the end of the run.')
+        os.makedirs(self.base_dir, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix=f'{self.worker_id}-', dir=self.base_dir)
+        if self.template_dir:
+            for path in storage_files(self.template_dir):
+                shutil.copy2(path, self.path)
+        return self.path
+
+    def prune_node(self, node_id: int) -> int:
+        """
+        Remove the entries of a node (sessions, resumption state, ...) from the storage once it has been unpaired,
+        so that the storage does not keep growing when a new node ID is commissioned at each iteration.
+
+        Returns:
+            int: The number of entries removed.
+        """
+        if self.path is None:
+            return 0
+        # Node IDs are stored as 16 upper case hexadecimal digits in the storage keys
+        node_key = f'{node_id:016X}'
+        removed = 0
+        for path in glob.glob(os.path.join(self.path, 'chip_tool_config*.ini')):
+            with open(path, 'r') as f:
+                lines = f.readlines()
+            kept = [line for line in lines if node_key not in line.split('=', 1)[0]]
+            if len(kept) != len(lines):
+                removed += len(lines) - len(kept)
+                with open(path, 'w') as f:
+                    f.writelines(kept)
+        return removed
+
+    def cleanup(self):
+        if self.path is not None:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path = None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Prepare a chip-tool storage template from an existing storage.')
+    parser.add_argument('template_dir', type=str)
+    parser.add_argument('--source_dir', type=str, default=DEFAULT_TEMPLATE_DIR)
+    args = parser.parse_args()
+    for path in prepare_template(args.template_dir, args.source_dir):
+        print(f'Copied {path}')
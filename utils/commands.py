@@ -1,7 +1,43 @@
 import subprocess
 import re
 import os
-from typing import Literal
+from time import time
+from typing import Callable, Literal, Optional
+
+from .tracing import span
+
+TIMEOUT_PATTERN = re.compile('Run command failure(.*)CHIP Error 0x00000032(.*)Timeout')
+FAILURE_PATTERN = re.compile(r'\*{5} Test Failure :')
+MANUAL_PAIRING_CODE_PATTERN = re.compile(r'Manual pairing code: \[(.*)]')
+# Printed by chip-tool when a command fails, timeouts included
+RUN_COMMAND_FAILURE = 'Run command failure'
+
+# chip-tool storage directory passed to every chip-tool command, None to use the chip-tool default (/tmp)
+chip_tool_storage_dir: Optional[str] = None
+
+
+def set_chip_tool_storage_dir(storage_dir: Optional[str]):
+    global chip_tool_storage_dir
+    chip_tool_storage_dir = storage_dir
+
+
+# Called with the output file and start time (epoch seconds) of a command that timed out (CHIP Error 0x00000032),
+# e.g. to save the Thread network samples around the timeout. None to only dump the syslog.
+timeout_handler: Optional[Callable[[Optional[str], float], None]] = None
+
+
+def set_timeout_handler(handler: Optional[Callable[[Optional[str], float], None]]):
+    global timeout_handler
+    timeout_handler = handler
+
+
+def chip_tool_cmd(chip_tool_path: str, args: str) -> str:
+    """
+    Build a chip-tool command line, using the storage directory set with set_chip_tool_storage_dir.
+    """
+    if chip_tool_storage_dir:
+        return f'{chip_tool_path} {args} --storage-directory {chip_tool_storage_dir}'
+    return f'{chip_tool_path} {args}'
 
 class CommandError:
     SUCCESS = 0x00
@@ -21,25 +57,52 @@ class CommandError:
             return "Open Commissioning Window Error"
         elif error_code == CommandError.COMMISSION_PAIRING_CODE_ERROR:
             return "Commission Pairing Code Error"
+        elif error_code == CommandError.TEST_FAILURE:
+            return "Test Failure"
+        elif error_code == CommandError.DEVICE_UNRESPONSIVE:
+            return "Device Unresponsive"
         else:
             return "Unknown Error"
 
 
+def command_span_name(chip_cmd: str) -> str:
+    """
+    Short name of a command for its trace span: the program name followed by its sub-commands,
+    e.g. "chip-tool onoff toggle".
+    """
+    tokens = chip_cmd.split()
+    if not tokens:
+        return 'cmd'
+    words = [os.path.basename(tokens[0])]
+    for token in tokens[1:4]:
+        if token.endswith('.py'):
+            words.append(os.path.basename(token))
+            continue
+        if token.startswith('-') or not token.replace('-', '').isalpha():
+            break
+        words.append(token)
+    return ' '.join(words)
+
+
 def send_cmd(chip_cmd, output_file: str = None,  extra_env_path: str = None, cwd: str = None):
     env = os.environ.copy()
     if extra_env_path:
         env["PYTHONPATH"] = extra_env_path
 
     print(f'===== cmd: {chip_cmd}')
-    process = subprocess.Popen(
-        chip_cmd,
-        env=env,
-        cwd=cwd,
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE
-    )
-    stdout, stderr = process.communicate()
+    cmd_start = time()
+    with span(command_span_name(chip_cmd), command=chip_cmd) as cmd_span:
+        process = subprocess.Popen(
+            chip_cmd,
+            env=env,
+            cwd=cwd,
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        cmd_span.set('pid', process.pid)
+        stdout, stderr = process.communicate()
+        cmd_span.set('returncode', process.returncode)
     buff = stdout.decode().splitlines(keepends=True)
 
     if output_file:
@@ -48,41 +111,43 @@ def send_cmd(chip_cmd, output_file: str = None,  extra_env_path: str = None, cwd
     else:
         print(''.join(buff))
 
+    timed_out = False
     for line in reversed(buff):
-        tiemout_pattern = re.compile('Run command failure(.*)CHIP Error 0x00000032(.*)Timeout')
-        matcher = tiemout_pattern.search(line)
+        matcher = TIMEOUT_PATTERN.search(line)
         if matcher:
+            timed_out = True
             print("########## TIMEOUT ##########")
             process = subprocess.Popen('sudo tail -n 50 /var/log/syslog', shell=True,
                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
             stdout, stderr = process.communicate()
-            buff = stdout.decode().splitlines(keepends=True)
+            syslog = stdout.decode().splitlines(keepends=True)
             if output_file:
                 with open(output_file, 'a') as f:
                     f.write("########## OTBR LOGS ##########\r\n")
-                    f.write(''.join(buff))
+                    f.write(''.join(syslog))
             else:
-                print(''.join(buff))
+                print(''.join(syslog))
 
-        failure_pattern = re.compile(r'\*{5} Test Failure :')
-        matcher = failure_pattern.search(line)
+        matcher = FAILURE_PATTERN.search(line)
         if matcher:
             print("########## FAILURE ##########")
             process = subprocess.Popen('sudo tail -n 50 /v ar/log/syslog', shell=True,
                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
             stdout, stderr = process.communicate()
-            buff = stdout.decode().splitlines(keepends=True)
+            syslog = stdout.decode().splitlines(keepends=True)
             if output_file:
                 with open(output_file, 'a') as f:
                     f.write("########## OTBR LOGS ##########\r\n")
-                    f.write(''.join(buff))
+                    f.write(''.join(syslog))
             else:
-                print(''.join(buff))
+                print(''.join(syslog))
+    if timed_out and timeout_handler is not None:
+        timeout_handler(output_file, cmd_start)
     return buff
 
 
 def commission_bleThread(nodeID, otbrhex, pin, discriminator, output_file: str, chipt_tool_path:str = '~/chip-tool') -> Literal[0,1]:
-    buff = send_cmd(f'{chipt_tool_path} pairing ble-thread {nodeID} hex:{otbrhex} {pin} {discriminator}', output_file)
+    buff = send_cmd(chip_tool_cmd(chipt_tool_path, f'pairing ble-thread {nodeID} hex:{otbrhex} {pin} {discriminator}'), output_file)
     for line in reversed(buff):
         if "Device commissioning completed with success" in line:
             return CommandError.SUCCESS
@@ -91,26 +156,29 @@ def commission_bleThread(nodeID, otbrhex, pin, discriminator, output_file: str,
 def commission_bleWifi(nodeID, ssid, password, pin, discriminator, output_file: str, chipt_tool_path:str = '~/chip-tool') -> Literal[0,1]:
     '''$ ./chip-tool pairing ble-wifi <node_id> <ssid> <password> <pin_code> <discriminator>
     '''
-    buff = send_cmd(f'{chipt_tool_path} pairing ble-wifi {nodeID} {ssid} {password} {pin} {discriminator}', output_file)
+    buff = send_cmd(chip_tool_cmd(chipt_tool_path, f'pairing ble-wifi {nodeID} {ssid} {password} {pin} {discriminator}'), output_file)
     for line in reversed(buff):
         if "Device commissioning completed with success" in line:
             return CommandError.SUCCESS
     return CommandError.BLE_COMMISSIONING_FAILURE
 
 
-def open_commissioning_window(output_file: str, chipt_tool_path:str = '~/chip-tool'):
-    buff = send_cmd(f'{chipt_tool_path} pairing open-commissioning-window 1 1 400 2000 3841', output_file)
+def open_commissioning_window(output_file: str, chipt_tool_path:str = '~/chip-tool', node_id: int = 1, option: int = 1,
+                              timeout: int = 400, iterations: int = 2000, discriminator: int = 3841):
+    '''$ ./chip-tool pairing open-commissioning-window <node_id> <option> <window_timeout> <iteration> <discriminator>
+    The iteration count is the PBKDF iteration count of the PASE verifier, the higher it is the longer computing it takes.
+    '''
+    buff = send_cmd(chip_tool_cmd(chipt_tool_path, f'pairing open-commissioning-window {node_id} {option} {timeout} {iterations} {discriminator}'), output_file)
     for line in reversed(buff):
         if 'Manual pairing code' in line:
-            pattern = re.compile(r'Manual pairing code: \[(.*)]')
-            matcher = pattern.search(line)
+            matcher = MANUAL_PAIRING_CODE_PATTERN.search(line)
             if matcher:
                 return matcher[1]
     return CommandError.OPEN_COMMISSIONING_WINDOW_ERROR
 
 
 def commission_pairing_code(code, fabric_idx, fabric_name, output_file: str, chipt_tool_path:str = '~/chip-tool')-> Literal[0,3]:
-    buff = send_cmd(f'{chipt_tool_path} pairing code {fabric_idx} {code} --commissioner-name {fabric_name}', output_file)
+    buff = send_cmd(chip_tool_cmd(chipt_tool_path, f'pairing code {fabric_idx} {code} --commissioner-name {fabric_name}'), output_file)
     for line in reversed(buff):
         if "Device commissioning completed with success" in line:
             return CommandError.SUCCESS
@@ -0,0 +1,162 @@
+import re
+from dataclasses import dataclass
+from time import monotonic
+from typing import Dict, List, Optional, Tuple
+
+from .chip_tool_session import ChipToolSession
+from .commands import (CommandError, MANUAL_PAIRING_CODE_PATTERN, RUN_COMMAND_FAILURE, commission_pairing_code,
+                       open_commissioning_window)
+
+# chip-tool log line: [1712345678.123456][12345:12346] CHIP:CTL: Commissioning stage next step: 'SecurePairing' -> 'ReadCommissioningInfo'
+COMMISSIONING_STAGE_PATTERN = re.compile(r"\[(\d+\.\d+)\].*Commissioning stage next step: '(\w+)' -> '(\w+)'")
+COMMISSIONING_SUCCESS = 'Device commissioning completed with success'
+COMMISSIONING_FAILURE = rf'Device commissioning (?:Failure|completed with failure)|{RUN_COMMAND_FAILURE}'
+# Time given to chip-tool, on top of the window timeout, to commission the device
+PAIRING_TIMEOUT_MARGIN = 60
+# PBKDF iteration count range of the PASE verifier allowed by the Matter specification
+PBKDF_MIN_ITERATIONS = 1000
+PBKDF_MAX_ITERATIONS = 100000
+
+
+def check_pbkdf_iterations(iterations: int):
+    """
+    Raises:
+        ValueError: If the PBKDF iteration count is outside the range allowed by the Matter specification.
+    """
+    if not PBKDF_MIN_ITERATIONS <= iterations <= PBKDF_MAX_ITERATIONS:
+        raise ValueError(f'Commissioning window PBKDF iterations must be between {PBKDF_MIN_ITERATIONS} and '
+                         f'{PBKDF_MAX_ITERATIONS}, got {iterations}')
+
+
+@dataclass
+class CommissioningWindow:
+    """
+    Parameters of the enhanced commissioning window opened to add a fabric.
+    """
+    node_id: int = 1
+    option: int = 1
+    timeout: int = 400
+    iterations: int = 2000
+    discriminator: int = 3841
+
+    def __post_init__(self):
+        check_pbkdf_iterations(self.iterations)
+
+    def command(self) -> str:
+        return (f'pairing open-commissioning-window {self.node_id} {self.option} {self.timeout} {self.iterations} '
+                f'{self.discriminator}')
+
+
+def parse_commissioning_stages(lines: List[str]) -> Dict[str, float]:
+    """
+    Compute the duration of each commissioning stage from the chip-tool log timestamps.
+
+    Returns:
+        Dict[str, float]: The duration in seconds of each stage that was left during the commissioning.
+    """
+    durations: Dict[str, float] = {}
+    stage_start: Optional[float] = None
+    for line in lines:
+        matcher = COMMISSIONING_STAGE_PATTERN.search(line)
+        if not matcher:
+            continue
+        timestamp, stage = float(matcher[1]), matcher[2].lstrip('k')
+        if stage_start is not None:
+            durations[stage] = durations.get(stage, 0.0) + timestamp - stage_start
+        stage_start = timestamp
+    return durations
+
+
+class CommissioningPipeline:
+    """
+    Add fabrics to a commissioned device: open a commissioning window from the first fabric, then commission the device
+    on the new fabric with the pairing code.
+
+    With a persistent controller session, both commands run in one chip-tool interactive process, started with the
+    first fabric (and restarted if it exits), and the pairing command is handed off as soon as the pairing code is
+    printed. Otherwise each command runs in its own chip-tool
+    process, as with open_commissioning_window and commission_pairing_code.
+    """
+
+    def __init__(self, chip_tool_path: str, output_file: str, window: CommissioningWindow,
+                 persistent_session: bool = False):
+        """
+        Args:
+            chip_tool_path (str): The path to the chip-tool binary.
+            output_file (str): The chip-tool output file.
+            window (CommissioningWindow): The commissioning window parameters.
+            persistent_session (bool, optional): Whether to run the commands in one chip-tool interactive session.
+        """
+        self.chip_tool_path = chip_tool_path
+        self.output_file = output_file
+        self.window = window
+        self.session: Optional[ChipToolSession] = None
+        if persistent_session:
+            self.session = ChipToolSession(chip_tool_path, output_file)
+
+    def __enter__(self) -> 'CommissioningPipeline':
+        return self
+
+    def __exit__(self, *exc):
+        if self.session is not None:
+            self.session.close()
+
+    def add_fabric(self, fabric_idx: int, fabric_name) -> Tuple[int, Dict[str, float]]:
+        """
+        Commission the device on a new fabric.
+
+        Args:
+            fabric_idx (int): The fabric index, also used as node ID on the new fabric.
+            fabric_name: The commissioner name of the new fabric.
+
+        Returns:
+            Tuple[int, Dict[str, float]]: CommandError.SUCCESS or the failed command error, and the duration in seconds
+            of each step: open_window, pairing_code and stage.<name> for each commissioning stage.
+        """
+        if self.session is not None:
+            return self._add_fabric_in_session(fabric_idx, fabric_name)
+
+        timings: Dict[str, float] = {}
+        step_start = monotonic()
+        pairing_code = open_commissioning_window(self.output_file, self.chip_tool_path, self.window.node_id,
+                                                 self.window.option, self.window.timeout, self.window.iterations,
+                                                 self.window.discriminator)
+        if CommandError.OPEN_COMMISSIONING_WINDOW_ERROR == pairing_code:
+            return CommandError.OPEN_COMMISSIONING_WINDOW_ERROR, timings
+        timings['open_window'] = monotonic() - step_start
+        step_start = monotonic()
+        result = commission_pairing_code(pairing_code, fabric_idx, fabric_name, self.output_file, self.chip_tool_path)
+        if result != CommandError.SUCCESS:
+            return CommandError.COMMISSION_PAIRING_CODE_ERROR, timings
+        timings['pairing_code'] = monotonic() - step_start
+        # send_cmd rewrites the output file for each command, it only holds the pairing output
+        with open(self.output_file, 'r', errors='replace') as f:
+            timings.update({f'stage.{k}': v for k, v in parse_commissioning_stages(f.readlines()).items()})
+        return CommandError.SUCCESS, timings
+
+    def _add_fabric_in_session(self, fabric_idx: int, fabric_name) -> Tuple[int, Dict[str, float]]:
+        timings: Dict[str, float] = {}
+        # Start the session, or restart it if chip-tool exited (e.g. crashed during the previous fabric)
+        if not self.session.alive and not self.session.start():
+            return CommandError.OPEN_COMMISSIONING_WINDOW_ERROR, timings
+
+        step_start = monotonic()
+        index, lines = self.session.run(self.window.command(), [MANUAL_PAIRING_CODE_PATTERN.pattern, RUN_COMMAND_FAILURE],
+                                        timeout=PAIRING_TIMEOUT_MARGIN)
+        matcher = None
+        if index == 0:
+            matcher = next((m for m in map(MANUAL_PAIRING_CODE_PATTERN.search, reversed(lines)) if m), None)
+        if matcher is None:
+            return CommandError.OPEN_COMMISSIONING_WINDOW_ERROR, timings
+        timings['open_window'] = monotonic() - step_start
+
+        # Hand-off: chip-tool reads the pairing command as soon as it is done with the window
+        step_start = monotonic()
+        index, lines = self.session.run(f'pairing code {fabric_idx} {matcher[1]} --commissioner-name {fabric_name}',
+                                        [COMMISSIONING_SUCCESS, COMMISSIONING_FAILURE],
+                                        timeout=self.window.timeout + PAIRING_TIMEOUT_MARGIN)
+        if index != 0:
+            return CommandError.COMMISSION_PAIRING_CODE_ERROR, timings
+        timings['pairing_code'] = monotonic() - step_start
+        timings.update({f'stage.{k}': v for k, v in parse_commissioning_stages(lines).items()})
+        return CommandError.SUCCESS, timings
@@ -0,0 +1,234 @@
+import argparse
+import dataclasses
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Mapping, Optional, Sequence
+
+from .chip_tool_storage import DEFAULT_STORAGE_BASE, DEFAULT_TEMPLATE_DIR
+from .commissioning import check_pbkdf_iterations
+
+DEFAULT_CHIP_PATH = os.path.expanduser('~/connectedhomeip')
+DEFAULT_SCRIPT_INPUT_JSON = 'script_input.json'
+DEFAULT_YAML_TEST_LIST_JSON = 'yaml_test_list.json'
+ENV_PREFIX = 'CHIP_AUTOMATION_'
+
+
+def str2bool(value: str) -> bool:
+    """
+    Convert a string representation of truth to a boolean value.
+    Args:
+        value (str): The string to convert. Accepts "yes", "true", "t", "1" for True and "no", "false", "f", "0" for False.
+    Returns:
+        bool: The boolean value.
+    Raises:
+        argparse.ArgumentTypeError: If the string is not a valid boolean representation.
+    """
+    if isinstance(value, bool):
+        return value
+    if value.lower() in ("yes", "true", "t", "1"):
+        return True
+    elif value.lower() in ("no", "false", "f", "0"):
+        return False
+    else:
+        raise argparse.ArgumentTypeError("Boolean value expected.")
+
+
+def str2list(value) -> List[str]:
+    """
+    Convert a comma-separated string (or a list) to a list of non-empty, stripped strings.
+    """
+    if isinstance(value, (list, tuple)):
+        return [str(v).strip() for v in value if str(v).strip()]
+    return [t.strip() for t in str(value).split(',') if t.strip()]
+
+
+@dataclass
+class TestConfig:
+    """
+    Typed configuration of a test run.
+
+    Values are resolved in a single pass by load_config(), from lowest to highest priority:
+    1. The defaults declared here.
+    2. Environment variables named CHIP_AUTOMATION_<FIELD> (e.g. CHIP_AUTOMATION_TARGET_DEVICE_IP).
+    3. The CLI arguments.
+    4. script_input.json, when use_script_input_json is set (its values override the CLI, the CLI values of the keys
+       missing from the JSON are kept).
+    """
+    chip_path: str = DEFAULT_CHIP_PATH
+    otbrhex: str = ''
+    discriminator: str = '3840'
+    pin: str = '20202021'
+    nodeID: int = 1
+    endpointID: str = '1'
+    target_device_ip: str = '10.4.215.46'
+    target_device_serial_num: str = ''
+    test_list: List[str] = field(default_factory=list)
+    use_json_list: bool = False
+    single_run_count: int = 0
+    multiple_run_count: int = 0
+    test_list_run_count: int = 0
+    test_plan_run_count: int = 0
+    toggle_test_run_count: int = 0
+    toggle_sleep_time: int = 1
+    toggle_count: int = 0
+    factory_reset_device: bool = False
+    commission_device: bool = False
+    use_script_input_json: bool = False
+    output_dir: str = './test_logs/'
+    thread_sample_interval: float = 10.0
+    thread_sample_buffer_size: int = 720
+    track_device_resources: bool = True
+    leak_threshold: float = 32.0
+    leak_min_iterations: int = 10
+    isolate_chip_tool_storage: bool = True
+    chip_tool_storage_base: str = DEFAULT_STORAGE_BASE
+    chip_tool_storage_template: str = DEFAULT_TEMPLATE_DIR
+    worker_id: str = ''
+    background_finalizer: bool = True
+    firmware_label: str = ''
+    trace: bool = True
+    commissioning_window_option: int = 1
+    commissioning_window_timeout: int = 400
+    commissioning_window_iterations: int = 2000
+    commissioning_window_discriminator: int = 3841
+    persistent_controller_session: bool = False
+
+    @property
+    def chip_tool_path(self) -> str:
+        return self.chip_path + '/out/standalone/chip-tool'
+
+    @property
+    def extra_env_path(self) -> str:
+        """
+        PYTHONPATH needed by chiptool.py to find the matter yamltests and idl packages.
+        """
+        matter_yamltests_path = os.path.join(self.chip_path, 'scripts', 'py_matter_yamltests')
+        matter_idl_path = os.path.join(self.chip_path, 'scripts', 'py_matter_idl')
+        extra_env_path = f"{matter_yamltests_path}:{matter_idl_path}"
+        existing_pythonpath = os.environ.get("PYTHONPATH", "")
+        if existing_pythonpath:
+            extra_env_path = f"{existing_pythonpath}:{extra_env_path}"
+        return extra_env_path
+
+    @classmethod
+    def field_types(cls) -> Dict[str, Any]:
+        return {f.name: f.type for f in dataclasses.fields(cls)}
+
+    def resolve_test_list(self, json_list_path: str = DEFAULT_YAML_TEST_LIST_JSON) -> List[str]:
+        """
+        Return the YAML tests to run, from yaml_test_list.json if use_json_list is set, from test_list otherwise.
+        """
+        if self.use_json_list:
+            with open(json_list_path, 'r') as f:
+                return json.load(f).get("YamlTestCasesToRun", [])
+        return list(self.test_list)
+
+
+_CONVERTERS = {
+    str: str,
+    int: int,
+    float: float,
+    bool: str2bool,
+    List[str]: str2list,
+}
+
+
+def _convert(name: str, value):
+    return _CONVERTERS[TestConfig.field_types()[name]](value)
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    """
+    Build the CLI parser. Every option defaults to None so that only the arguments actually given override the
+    defaults and environment values.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chip_path', type=str, required=False)
+    parser.add_argument('--otbrhex', type=str, required=False)
+    parser.add_argument('--discriminator', type=str, required=False)
+    parser.add_argument('--pin', type=str, required=False)
+    parser.add_argument('--nodeID', type=int, required=False)
+    parser.add_argument('--endpointID', type=str, required=False)
+    parser.add_argument('--target_device_ip', type=str, required=False)
+    parser.add_argument('--target_device_serial_num', type=str, required=False)
+    parser.add_argument('--test_list', type=str2list, required=False)
+    parser.add_argument('--use_json_list', type=str2bool, required=False)
+    parser.add_argument('--single_run_count', type=int, required=False)
+    parser.add_argument('--multiple_run_count', type=int, required=False)
+    parser.add_argument('--test_list_run_count', type=int, required=False)
+    parser.add_argument('--test_plan_run_count', type=int, required=False)
+    parser.add_argument('--toggle_test_run_count', type=int, required=False)
+    parser.add_argument('--toggle_sleep_time', type=int, required=False)
+    parser.add_argument('--toggle_count', type=int, required=False)
+    parser.add_argument('--factory_reset_device', type=str2bool, required=False)
+    parser.add_argument('--commission_device', type=str2bool, required=False)
+    parser.add_argument('--use_script_input_json', type=str2bool, required=False)
+    parser.add_argument('--output_dir', type=str, required=False)
+    parser.add_argument('--thread_sample_interval', type=float, required=False)
+    parser.add_argument('--thread_sample_buffer_size', type=int, required=False)
+    parser.add_argument('--track_device_resources', type=str2bool, required=False)
+    parser.add_argument('--leak_threshold', type=float, required=False)
+    parser.add_argument('--leak_min_iterations', type=int, required=False)
+    parser.add_argument('--isolate_chip_tool_storage', type=str2bool, required=False)
+    parser.add_argument('--chip_tool_storage_base', type=str, required=False)
+    parser.add_argument('--chip_tool_storage_template', type=str, required=False)
+    parser.add_argument('--worker_id', type=str, required=False)
+    parser.add_argument('--background_finalizer', type=str2bool, required=False)
+    parser.add_argument('--firmware_label', type=str, required=False)
+    parser.add_argument('--trace', type=str2bool, required=False)
+    parser.add_argument('--commissioning_window_option', type=int, required=False)
+    parser.add_argument('--commissioning_window_timeout', type=int, required=False)
+    parser.add_argument('--commissioning_window_iterations', type=int, required=False)
+    parser.add_argument('--commissioning_window_discriminator', type=int, required=False)
+    parser.add_argument('--persistent_controller_session', type=str2bool, required=False)
+    return parser
+
+
+def load_config(
+        argv: Optional[Sequence[str]] = None,
+        environ: Optional[Mapping[str, str]] = None,
+        script_input_json: str = DEFAULT_SCRIPT_INPUT_JSON
+    ) -> TestConfig:
+    """
+    Merge the defaults, environment, CLI and script_input.json values into a TestConfig.
+
+    Args:
+        argv (Sequence[str], optional): The CLI arguments, defaults to sys.argv[1:].
+        environ (Mapping[str, str], optional): The environment, defaults to os.environ.
+        script_input_json (str, optional): The JSON file to use when use_script_input_json is set.
+
+    Returns:
+        TestConfig: The resolved configuration.
+
+    Exits through the CLI parser error if a value is out of its allowed range (e.g. commissioning_window_iterations),
+    whichever source it comes from.
+    """
+    if environ is None:
+        environ = os.environ
+    values: Dict[str, Any] = {}
+
+    for name in TestConfig.field_types():
+        env_value = environ.get(ENV_PREFIX + name.upper())
+        if env_value is not None and env_value != '':
+            values[name] = _convert(name, env_value)
+
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+    for name, value in vars(args).items():
+        if value is not None:
+            values[name] = value
+
+    if values.get('use_script_input_json', False):
+        with open(script_input_json, 'r') as f:
+            json_args = json.load(f)
+        for name, value in json_args.items():
+            if name in TestConfig.field_types():
+                values[name] = _convert(name, value)
+
+    config = TestConfig(**values)
+    try:
+        check_pbkdf_iterations(config.commissioning_window_iterations)
+    except ValueError as e:
+        parser.error(str(e))
+    return config
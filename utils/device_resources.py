@@ -0,0 +1,184 @@
+import json
+import os
+import re
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+# Device log lines holding resource usage. The minimum free heap is checked before the free heap as their wording
+# overlaps ("Minimum ever free heap size: 1234").
+HEAP_MIN_FREE_PATTERN = re.compile(
+    r'(?:min(?:imum)?(?: ever)? free heap|heap (?:low[- ]?water(?: mark)?|min(?:imum)?(?: free)?)|heap_min(?:_free)?)'
+    r'(?: size)?\s*[:=]?\s*(\d+)', re.IGNORECASE)
+HEAP_FREE_PATTERN = re.compile(r'(?:free heap|heap free|heap_free|freeheap)(?: size)?\s*[:=]?\s*(\d+)', re.IGNORECASE)
+STACK_PATTERN = re.compile(
+    r'(?:task|thread)\s*[:=]?\s*[\'"]?(?P<task>[\w-]+)[\'"]?\s*[:,]?\s*(?:stack\s*)?'
+    r'(?:high[- ]?water(?: mark)?|hwm|free stack|stack free)\s*[:=]?\s*(?P<value>\d+)', re.IGNORECASE)
+SESSIONS_PATTERN = re.compile(r'\bsessions?(?: in use| count| active)?\s*[:=]\s*(\d+)', re.IGNORECASE)
+EXCHANGES_PATTERN = re.compile(r'\bexchanges?(?: in use| count| active)?\s*[:=]\s*(\d+)', re.IGNORECASE)
+REBOOT_MARKERS = ('Reset reason', 'Booting', 'Init CHIP Stack')
+# A boot prints several of the reboot markers, the markers within this many lines of the previous one are the same boot
+BOOT_SEQUENCE_LINES = 50
+ASSERT_MARKERS = ('assert', 'Assert', 'HardFault', 'Hard Fault', 'chipDie', 'VerifyOrDie')
+
+
+@dataclass
+class ResourceSample:
+    """
+    Resource usage of the device over one test iteration.
+    """
+    series: str
+    iteration: int
+    heap_free: Optional[int] = None
+    heap_min_free: Optional[int] = None
+    stack_high_water: Dict[str, int] = field(default_factory=dict)
+    sessions: Optional[int] = None
+    exchanges: Optional[int] = None
+    reboots: int = 0
+    asserts: int = 0
+
+
+def parse_device_log(path: str, sample: ResourceSample):
+    """
+    Stream a device log (UART or RTT) and update the sample with the resource usage it reports.
+    The last free heap value and the lowest low-water marks are kept, sessions and exchanges keep their peak.
+    Each boot sequence counts as one reboot, whichever of the reboot markers it prints.
+    """
+    last_boot_line: Optional[int] = None
+    with open(path, 'r', errors='replace') as f:
+        for line_number, line in enumerate(f):
+            if any(marker in line for marker in REBOOT_MARKERS):
+                if last_boot_line is None or line_number - last_boot_line > BOOT_SEQUENCE_LINES:
+                    sample.reboots += 1
+                last_boot_line = line_number
+            if any(marker in line for marker in ASSERT_MARKERS):
+                sample.asserts += 1
+            lower = line.lower()
+            if 'heap' in lower:
+                matcher = HEAP_MIN_FREE_PATTERN.search(line)
+                if matcher:
+                    value = int(matcher[1])
+                    sample.heap_min_free = value if sample.heap_min_free is None else min(sample.heap_min_free, value)
+                else:
+                    matcher = HEAP_FREE_PATTERN.search(line)
+                    if matcher:
+                        sample.heap_free = int(matcher[1])
+            if 'stack' in lower or 'hwm' in lower or 'water' in lower:
+                matcher = STACK_PATTERN.search(line)
+                if matcher:
+                    task, value = matcher['task'], int(matcher['value'])
+                    sample.stack_high_water[task] = min(value, sample.stack_high_water.get(task, value))
+            if 'session' in lower:
+                matcher = SESSIONS_PATTERN.search(line)
+                if matcher:
+                    sample.sessions = max(int(matcher[1]), sample.sessions or 0)
+            if 'exchange' in lower:
+                matcher = EXCHANGES_PATTERN.search(line)
+                if matcher:
+                    sample.exchanges = max(int(matcher[1]), sample.exchanges or 0)
+
+
+def linear_slope(xs: List[float], ys: List[float]) -> float:
+    """
+    Least squares slope of ys over xs.
+    """
+    n = len(xs)
+    mean_x = sum(xs) / n
+    mean_y = sum(ys) / n
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    if variance == 0:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance
+
+
+class DeviceResourceTracker:
+    """
+    Record the device resource usage of each iteration of the soak loops and flag the resources trending down.
+
+    Each iteration is appended as a JSON line to the report file. The samples are grouped in series (e.g. one per
+    test loop) as each loop has its own steady state.
+    """
+
+    def __init__(self, report_file: str, leak_threshold: float = 32.0, min_iterations: int = 10):
+        """
+        Args:
+            report_file (str): The JSON lines file the samples are appended to.
+            leak_threshold (float, optional): Heap decrease, in bytes per iteration, over which a leak is flagged.
+            min_iterations (int, optional): Number of iterations needed before a trend is computed.
+        """
+        self.report_file = report_file
+        self.leak_threshold = leak_threshold
+        self.min_iterations = min_iterations
+        self.series: Dict[str, List[ResourceSample]] = {}
+        self._flagged = set()
+
+    def record(self, series: str, log_files: Iterable[str]) -> ResourceSample:
+        """
+        Parse the device logs of an iteration, store the resulting sample and print the leaks detected so far.
+
+        Args:
+            series (str): The series the iteration belongs to.
+            log_files (Iterable[str]): The device log files (UART, RTT) of the iteration, missing files are skipped.
+
+        Returns:
+            ResourceSample: The sample of the iteration.
+        """
+        samples = self.series.setdefault(series, [])
+        sample = ResourceSample(series=series, iteration=len(samples) + 1)
+        for log_file in log_files:
+            if os.path.exists(log_file):
+                parse_device_log(log_file, sample)
+        samples.append(sample)
+        with open(self.report_file, 'a') as f:
+            f.write(json.dumps(asdict(sample)) + '\n')
+
+        for warning in self.check_trends(series):
+            print(f'########## RESOURCE WARNING ########## {warning}')
+        return sample
+
+    def trends(self, series: str) -> Dict[str, float]:
+        """
+        Compute the per-iteration slope of each tracked resource of a series.
+        """
+        samples = self.series.get(series, [])
+        values: Dict[str, List] = {name: [] for name in ('heap_free', 'heap_min_free', 'sessions', 'exchanges')}
+        stacks: Dict[str, List] = {}
+        for sample in samples:
+            for name, points in values.items():
+                value = getattr(sample, name)
+                if value is not None:
+                    points.append((sample.iteration, value))
+            for task, value in sample.stack_high_water.items():
+                stacks.setdefault(f'stack_high_water.{task}', []).append((sample.iteration, value))
+        values.update(stacks)
+
+        trends = {}
+        for name, points in values.items():
+            if len(points) >= self.min_iterations:
+                trends[name] = linear_slope([p[0] for p in points], [p[1] for p in points])
+        return trends
+
+    def check_trends(self, series: str) -> List[str]:
+        """
+        Return the warnings newly raised for a series: heap or stack decreasing faster than the leak threshold,
+        sessions or exchanges increasing, device reboots or asserts during the last iteration.
+        """
+        warnings = []
+        samples = self.series.get(series, [])
+        if samples and (samples[-1].reboots or samples[-1].asserts):
+            warnings.append(f'{series} iteration {samples[-1].iteration}: {samples[-1].reboots} boot(s), '
+                            f'{samples[-1].asserts} assert(s) in the device logs')
+
+        for name, slope in self.trends(series).items():
+            if name in ('sessions', 'exchanges'):
+                leaking = slope > 0.5
+            else:
+                leaking = -slope > self.leak_threshold
+            if leaking and (series, name) not in self._flagged:
+                self._flagged.add((series, name))
+                direction = 'increasing' if slope > 0 else 'decreasing'
+                warnings.append(f'{series}: possible leak, {name} {direction} by {abs(slope):.1f} per iteration '
+                                f'over {len(samples)} iterations')
+        return warnings
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {series: self.trends(series) for series in self.series}
@@ -0,0 +1,249 @@
+import argparse
+import json
+import os
+import re
+from collections import defaultdict
+from multiprocessing import Pool
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Log file suffixes written by main.py
+CHIP_TOOL_SUFFIX = '_chip-tool-logs.txt'
+CHIP_TOOL_ERROR_SUFFIX = '_chip-tool-error-logs.txt'
+DEVICE_UART_ERROR_SUFFIX = '_device-uart-error-logs.txt'
+
+# Lines kept as part of an error signature. The substring is checked first as it is much cheaper than the regex.
+CHIP_TOOL_ERROR_MARKERS = (
+    'Run command failure',
+    'Test Failure',
+    'completed with failure',
+    'CHIP Error',
+    'Timeout',
+)
+DEVICE_ERROR_MARKERS = (
+    'assert',
+    'Assert',
+    'HardFault',
+    'Hard Fault',
+    'Reset reason',
+)
+MAX_SIGNATURE_LINES = 3
+
+# Normalization applied to error lines, in order, so that the same failure on different runs gets the same signature.
+NORMALIZATION_PATTERNS = [
+    # chip-tool log prefix: [1712345678.123456][12345:12346] CHIP:CTL:
+    (re.compile(r'\[\d+(\.\d+)?\]\s*\[\d+:\d+\]'), ''),
+    (re.compile(r'\b\d{4}-\d{2}-\d{2}[ T_]\d{2}[:-]\d{2}[:-]\d{2}(\.\d+)?\b'), '<TS>'),
+    (re.compile(r'\b\d{2}:\d{2}:\d{2}(\.\d+)?\b'), '<TS>'),
+    (re.compile(r'\b(?:[0-9a-fA-F]{2}[:-]){5,7}[0-9a-fA-F]{2}\b'), '<MAC>'),
+    # Compressed IPv6 form first, the full form would stop at the "::"
+    (re.compile(r'\b(?:[0-9a-fA-F]{1,4}(?::[0-9a-fA-F]{1,4})*::(?:[0-9a-fA-F]{1,4}(?::[0-9a-fA-F]{1,4})*)?'
+                r'|(?:[0-9a-fA-F]{1,4}:){3,7}[0-9a-fA-F]{1,4})(%\w+)?'), '<ADDR>'),
+    (re.compile(r'\b\d{1,3}(\.\d{1,3}){3}(:\d+)?\b'), '<ADDR>'),
+    (re.compile(r'\b[0-9A-F]{16}\b'), '<ID>'),
+    (re.compile(r'\b0x[0-9a-fA-F]{9,}\b'), '<ID>'),
+    (re.compile(r'(?i)\b(node|node ?id|fabric ?index|fabric|session|exchange)([ :=#]+)(0x)?[0-9a-f]+'), r'\1\2<N>'),
+    (re.compile(r'\b\d{5,}\b'), '<N>'),
+    (re.compile(r'\s+'), ' '),
+]
+
+# Test names encoded in the log file names (see the output_file names built by the test loops of main.py)
+TEST_NAME_PATTERNS = [
+    (re.compile(r'_test_plan_run_\d+_(?P<test>.+)_run_\d+$'), None),
+    (re.compile(r'_test_plan_run_commissioning$'), 'yaml_commissioning'),
+    (re.compile(r'_single_run_\d+$'), 'single_fabric_commissioning'),
+    (re.compile(r'_multiple_run_\d+$'), 'multiple_fabric_commissioning'),
+    (re.compile(r'_toggle_test_$'), 'toggle_test'),
+]
+
+
+def normalize_error_line(line: str) -> str:
+    """
+    Strip the run-specific parts (timestamps, node IDs, addresses, ...) of an error line.
+    """
+    for pattern, replacement in NORMALIZATION_PATTERNS:
+        line = pattern.sub(replacement, line)
+    return line.strip()
+
+
+def test_name_from_iteration(iteration: str) -> str:
+    """
+    Get the test name from an iteration log prefix (the log file name without its suffix).
+    """
+    for pattern, name in TEST_NAME_PATTERNS:
+        matcher = pattern.search(iteration)
+        if matcher:
+            return name if name is not None else matcher['test']
+    return 'unknown'
+
+
+def iteration_sort_key(iteration: str) -> Tuple:
+    """
+    Sort iterations by run date then by the run numbers, compared as integers.
+    """
+    return tuple(int(t) if t.isdigit() else t for t in re.split(r'(\d+)', iteration))
+
+
+def extract_signature(path: str, markers: Iterable[str], max_lines: int = MAX_SIGNATURE_LINES) -> Optional[str]:
+    """
+    Stream a log file and build the normalized signature of its first error lines.
+
+    Returns:
+        Optional[str]: The signature, '' if the file is empty, None if no error line was found.
+    """
+    lines: List[str] = []
+    empty = True
+    with open(path, 'r', errors='replace') as f:
+        for line in f:
+            empty = False
+            if any(marker in line for marker in markers):
+                normalized = normalize_error_line(line)
+                if normalized and normalized not in lines:
+                    lines.append(normalized)
+                    if len(lines) >= max_lines:
+                        break
+    if empty:
+        return ''
+    return ' | '.join(lines) if lines else None
+
+
+def analyze_iteration(paths: Tuple[Optional[str], Optional[str]]) -> Tuple[str, str]:
+    """
+    Compute the failure signature of a failed iteration from its chip-tool and device UART error logs.
+    """
+    chip_tool_path, uart_path = paths
+    signature = None
+    if chip_tool_path is not None:
+        signature = extract_signature(chip_tool_path, CHIP_TOOL_ERROR_MARKERS)
+    if uart_path is not None:
+        device_signature = extract_signature(uart_path, DEVICE_ERROR_MARKERS)
+        if device_signature == '':
+            device_signature = 'Device unresponsive (empty UART log)'
+        if device_signature:
+            signature = f'{signature} || device: {device_signature}' if signature else f'device: {device_signature}'
+    if not signature:
+        signature = '<no error signature>'
+    return chip_tool_path or uart_path, signature
+
+
+def scan_log_dirs(log_dirs: Iterable[str]) -> Iterator[Tuple[str, str, Optional[Tuple[Optional[str], Optional[str]]]]]:
+    """
+    Walk the log directories and yield (iteration, status, error chip-tool log) for each iteration found.
+    status is 'pass' or 'fail'. Only the file names are looked at, no file is opened.
+    """
+    for log_dir in log_dirs:
+        for root, _, files in os.walk(log_dir):
+            iterations: Dict[str, Dict[str, str]] = defaultdict(dict)
+            for name in files:
+                for suffix in (CHIP_TOOL_SUFFIX, CHIP_TOOL_ERROR_SUFFIX, DEVICE_UART_ERROR_SUFFIX):
+                    if name.endswith(suffix):
+                        iterations[name[:-len(suffix)]][suffix] = os.path.join(root, name)
+                        break
+            for iteration, logs in iterations.items():
+                if CHIP_TOOL_ERROR_SUFFIX in logs or DEVICE_UART_ERROR_SUFFIX in logs:
+                    yield iteration, 'fail', (logs.get(CHIP_TOOL_ERROR_SUFFIX), logs.get(DEVICE_UART_ERROR_SUFFIX))
+                else:
+                    yield iteration, 'pass', None
+
+
+def flakiness_index(outcomes: List[bool]) -> float:
+    """
+    Flip rate of a test: the fraction of consecutive runs whose outcome changed. A test that always fails or always
+    passes has an index of 0, a test alternating pass / fail has an index of 1.
+    """
+    if len(outcomes) < 2:
+        return 0.0
+    flips = sum(1 for a, b in zip(outcomes, outcomes[1:]) if a != b)
+    return flips / (len(outcomes) - 1)
+
+
+def analyze_logs(log_dirs: Iterable[str], known_tests: Iterable[str] = (), processes: Optional[int] = None) -> Dict:
+    """
+    Cluster the failures of the archived logs by normalized error signature and compute per-test statistics.
+
+    Args:
+        log_dirs (Iterable[str]): The log directories to scan (recursively).
+        known_tests (Iterable[str], optional): Tests always listed in the report, even if they never ran.
+        processes (int, optional): Number of worker processes parsing the error logs. Defaults to the CPU count.
+
+    Returns:
+        Dict: The report, with the 'clusters' sorted by size and the per-test 'tests' statistics.
+    """
+    outcomes: Dict[str, List[Tuple[str, bool]]] = defaultdict(list)
+    failed: List[Tuple[Optional[str], Optional[str]]] = []
+    iteration_of: Dict[str, str] = {}
+    for iteration, status, paths in scan_log_dirs(log_dirs):
+        outcomes[test_name_from_iteration(iteration)].append((iteration, status == 'fail'))
+        if status == 'fail':
+            failed.append(paths)
+            iteration_of[paths[0] or paths[1]] = iteration
+
+    clusters: Dict[str, Dict] = {}
+    if failed:
+        with Pool(processes) as pool:
+            for path, signature in pool.imap_unordered(analyze_iteration, failed, chunksize=16):
+                iteration = iteration_of[path]
+                cluster = clusters.setdefault(signature, {'signature': signature, 'count': 0, 'tests': defaultdict(int),
+                                                          'examples': []})
+                cluster['count'] += 1
+                cluster['tests'][test_name_from_iteration(iteration)] += 1
+                cluster['examples'].append(path)
+
+    for cluster in clusters.values():
+        cluster['tests'] = dict(cluster['tests'])
+        cluster['examples'] = sorted(cluster['examples'], key=iteration_sort_key)[:5]
+
+    tests = {name: {'runs': 0, 'failures': 0, 'failure_rate': 0.0, 'flakiness_index': 0.0} for name in known_tests}
+    for name, runs in outcomes.items():
+        results = [failed_run for _, failed_run in sorted(runs, key=lambda r: iteration_sort_key(r[0]))]
+        failures = sum(results)
+        tests[name] = {
+            'runs': len(results),
+            'failures': failures,
+            'failure_rate': failures / len(results),
+            'flakiness_index': flakiness_index(results),
+        }
+
+    return {
+        'iterations': sum(t['runs'] for t in tests.values()),
+        'failures': len(failed),
+        'clusters': sorted(clusters.values(), key=lambda c: c['count'], reverse=True),
+        'tests': dict(sorted(tests.items(), key=lambda t: (-t[1]['flakiness_index'], -t[1]['failure_rate'], t[0]))),
+    }
+
+
+def print_report(report: Dict, max_clusters: int = 20):
+    print(f"Iterations: {report['iterations']}, failures: {report['failures']}, "
+          f"failure clusters: {len(report['clusters'])}")
+    print('\n===== Failure clusters =====')
+    for cluster in report['clusters'][:max_clusters]:
+        tests = ', '.join(f'{name} ({count})' for name, count in sorted(cluster['tests'].items()))
+        print(f"[{cluster['count']:5d}] {cluster['signature']}")
+        print(f'        tests: {tests}')
+        print(f"        e.g. {cluster['examples'][0]}")
+    print('\n===== Tests =====')
+    print(f"{'Test':40s} {'Runs':>6s} {'Fails':>6s} {'Fail %':>7s} {'Flaky':>6s}")
+    for name, stats in report['tests'].items():
+        print(f"{name:40s} {stats['runs']:6d} {stats['failures']:6d} {100 * stats['failure_rate']:6.1f}% "
+              f"{stats['flakiness_index']:6.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cluster the failures and compute the flakiness of archived test logs.')
+    parser.add_argument('log_dirs', nargs='*', default=['./test_logs/'])
+    parser.add_argument('--yaml_test_list', type=str, default='yaml_test_list.json',
+                        help='JSON test list whose tests are always listed in the report.')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--json_output', type=str, default=None, help='Also write the full report to this JSON file.')
+    parser.add_argument('--max_clusters', type=int, default=20)
+    args = parser.parse_args()
+
+    known_tests: List[str] = []
+    if args.yaml_test_list and os.path.exists(args.yaml_test_list):
+        with open(args.yaml_test_list, 'r') as f:
+            known_tests = json.load(f).get("YamlTestCasesToRun", [])
+
+    report = analyze_logs(args.log_dirs, known_tests, args.processes)
+    print_report(report, args.max_clusters)
+    if args.json_output:
+        with open(args.json_output, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,126 @@
+import os
+import queue
+import subprocess
+import tarfile
+import threading
+from typing import Callable, List, Optional, Tuple
+
+from .tracing import traced
+
+OTBR_LOG_CMD = 'sudo journalctl -u otbr-agent --no-pager -o short-precise'
+
+
+def write_otbr_slice(output_file: str, start: float, end: float) -> bool:
+    """
+    Write the OTBR agent logs of a [start, end] window (epoch seconds) to a file.
+
+    Returns:
+        bool: True if the file was written.
+    """
+    result = subprocess.run(f'{OTBR_LOG_CMD} --since @{int(start)} --until @{int(end) + 1}', shell=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        return False
+    with open(output_file, 'wb') as f:
+        f.write(result.stdout)
+    return True
+
+
+def move_logs(renames: List[Tuple[str, str]]) -> List[str]:
+    """
+    Rename the logs of a failed iteration to their error log names. This is cheap and done before the next iteration
+    starts, as it may write to the same log paths.
+
+    Args:
+        renames (List[Tuple[str, str]]): The (source, destination) log renames, missing sources are skipped.
+
+    Returns:
+        List[str]: The destination paths.
+    """
+    for src, dst in renames:
+        if os.path.exists(src):
+            os.replace(src, dst)
+    return [dst for _, dst in renames]
+
+
+@traced()
+def finalize_failure(
+        bundle_file: str,
+        bundle_members: List[str],
+        otbr_slice: Optional[Tuple[str, float, float]] = None
+    ) -> str:
+    """
+    Finalize the artifacts of a failed iteration, once its logs have been moved with move_logs.
+    Steps:
+    1. Extract the OTBR logs of the iteration window (if requested).
+    2. Bundle the error logs, OTBR logs and any other member into a compressed archive.
+
+    Args:
+        bundle_file (str): The archive to create (.tar.gz).
+        bundle_members (List[str]): The files to add to the archive, missing files are skipped.
+        otbr_slice (Tuple[str, float, float], optional): The (output file, start, end) of the OTBR logs to extract.
+
+    Returns:
+        str: The archive path.
+    """
+    members = list(bundle_members)
+    if otbr_slice is not None and write_otbr_slice(*otbr_slice):
+        members.append(otbr_slice[0])
+
+    with tarfile.open(bundle_file, 'w:gz') as bundle:
+        for member in members:
+            if os.path.exists(member):
+                bundle.add(member, arcname=os.path.basename(member))
+    return bundle_file
+
+
+class LogFinalizer:
+    """
+    Background worker running the log bookkeeping of the test iterations (Thread network reports, OTBR log
+    extraction, failure bundles) so that the next iteration can start right away.
+    """
+
+    def __init__(self):
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='log-finalizer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Wait for the pending jobs and stop the worker.
+        """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def flush(self):
+        """
+        Wait for the pending jobs.
+        """
+        self._queue.join()
+
+    def submit(self, job: Callable, *args, **kwargs):
+        self._queue.put((job, args, kwargs))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                job, args, kwargs = item
+                try:
+                    result = job(*args, **kwargs)
+                    if result:
+                        print(f'Finalized {result}')
+                except Exception as e:
+                    print(f'Log finalization failed: {e}')
+            finally:
+                self._queue.task_done()
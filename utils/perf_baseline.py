@@ -0,0 +1,215 @@
+import argparse
+import json
+import math
+import os
+import random
+import sys
+from contextlib import contextmanager
+from time import monotonic
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_BASELINE_DIR = './baselines/'
+DEFAULT_THRESHOLD = 0.10
+DEFAULT_ALPHA = 0.05
+MIN_SAMPLES = 3
+BOOTSTRAP_RESAMPLES = 2000
+
+
+class RunMetrics:
+    """
+    Durations (in seconds) of the steps of a run, grouped by metric name (e.g. commissioning.ble_thread, onoff.toggle,
+    yaml.Test_TC_CC_3_1).
+    """
+
+    def __init__(self, label: str = ''):
+        self.label = label
+        self.metrics: Dict[str, List[float]] = {}
+
+    def add(self, name: str, duration: float):
+        self.metrics.setdefault(name, []).append(duration)
+
+    @contextmanager
+    def measure(self, name: str):
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, monotonic() - start)
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            json.dump({'label': self.label, 'metrics': self.metrics}, f, indent=2)
+
+    @staticmethod
+    def load(path: str) -> 'RunMetrics':
+        with open(path, 'r') as f:
+            data = json.load(f)
+        run_metrics = RunMetrics(data.get('label', ''))
+        run_metrics.metrics = {name: list(values) for name, values in data.get('metrics', {}).items()}
+        return run_metrics
+
+    def merge(self, other: 'RunMetrics'):
+        for name, values in other.metrics.items():
+            self.metrics.setdefault(name, []).extend(values)
+
+
+def median(values: List[float]) -> float:
+    ordered = sorted(values)
+    n = len(ordered)
+    return ordered[n // 2] if n % 2 else (ordered[n // 2 - 1] + ordered[n // 2]) / 2
+
+
+def mann_whitney_u(baseline: List[float], candidate: List[float]) -> Tuple[float, float]:
+    """
+    One-sided Mann-Whitney U test of the candidate values being greater (slower) than the baseline values, using the
+    normal approximation with tie correction.
+
+    Returns:
+        Tuple[float, float]: The U statistic of the candidate and the p-value.
+    """
+    n1, n2 = len(baseline), len(candidate)
+    values = sorted([(v, 0) for v in baseline] + [(v, 1) for v in candidate])
+    ranks = [0.0] * len(values)
+    ties = 0.0
+    i = 0
+    while i < len(values):
+        j = i
+        while j + 1 < len(values) and values[j + 1][0] == values[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1
+        t = j - i + 1
+        ties += t ** 3 - t
+        i = j + 1
+    rank_sum = sum(rank for rank, (_, group) in zip(ranks, values) if group == 1)
+    u = rank_sum - n2 * (n2 + 1) / 2
+    n = n1 + n2
+    variance = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))
+    if variance <= 0:
+        return u, 1.0
+    # Continuity correction
+    z = (u - n1 * n2 / 2 - 0.5) / math.sqrt(variance)
+    return u, 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def bootstrap_ratio_ci(baseline: List[float], candidate: List[float], confidence: float = 0.95,
+                       resamples: int = BOOTSTRAP_RESAMPLES, seed: int = 0) -> Tuple[float, float]:
+    """
+    Percentile bootstrap confidence interval of the ratio of the candidate median over the baseline median.
+    """
+    rng = random.Random(seed)
+    ratios = []
+    for _ in range(resamples):
+        b = median([rng.choice(baseline) for _ in baseline])
+        c = median([rng.choice(candidate) for _ in candidate])
+        if b > 0:
+            ratios.append(c / b)
+    if not ratios:
+        return math.nan, math.nan
+    ratios.sort()
+    low = ratios[int((1 - confidence) / 2 * (len(ratios) - 1))]
+    high = ratios[int((1 + confidence) / 2 * (len(ratios) - 1))]
+    return low, high
+
+
+def compare_metrics(baseline: RunMetrics, candidate: RunMetrics, threshold: float = DEFAULT_THRESHOLD,
+                    alpha: float = DEFAULT_ALPHA) -> List[Dict]:
+    """
+    Compare each metric of a candidate run against the baseline.
+
+    A metric regresses when its median is more than threshold slower than the baseline median and the Mann-Whitney
+    test finds the candidate significantly slower (p < alpha). Metrics with less than MIN_SAMPLES values on either
+    side are reported but never fail the gate.
+
+    Returns:
+        List[Dict]: One result per metric, the worst relative change first.
+    """
+    results = []
+    for name in sorted(set(baseline.metrics) | set(candidate.metrics)):
+        b, c = baseline.metrics.get(name, []), candidate.metrics.get(name, [])
+        result = {'metric': name, 'baseline_n': len(b), 'candidate_n': len(c), 'status': 'SKIP'}
+        if b and c:
+            b_median, c_median = median(b), median(c)
+            result.update({
+                'baseline_median': b_median,
+                'candidate_median': c_median,
+                'change': c_median / b_median - 1 if b_median > 0 else math.nan,
+            })
+        if len(b) >= MIN_SAMPLES and len(c) >= MIN_SAMPLES:
+            _, p_value = mann_whitney_u(b, c)
+            low, high = bootstrap_ratio_ci(b, c, 1 - alpha)
+            result.update({'p_value': p_value, 'ci_low': low - 1, 'ci_high': high - 1})
+            result['status'] = 'FAIL' if result['change'] > threshold and p_value < alpha else 'PASS'
+        results.append(result)
+    results.sort(key=lambda r: -r['change'] if 'change' in r and not math.isnan(r['change']) else math.inf)
+    return results
+
+
+def print_comparison(results: List[Dict], max_lines: Optional[int] = None):
+    print(f"{'Metric':45s} {'Base (s)':>9s} {'New (s)':>9s} {'Change':>8s} {'95% CI':>17s} {'p':>7s}  Status")
+    for result in results[:max_lines]:
+        if 'change' not in result:
+            print(f"{result['metric']:45s} {'-':>9s} {'-':>9s} {'-':>8s} {'':>17s} {'':>7s}  {result['status']} "
+                  f"(n={result['baseline_n']}/{result['candidate_n']})")
+            continue
+        ci = f"[{100 * result['ci_low']:+.1f}, {100 * result['ci_high']:+.1f}]%" if 'ci_low' in result else ''
+        p_value = f"{result['p_value']:.3f}" if 'p_value' in result else ''
+        print(f"{result['metric']:45s} {result['baseline_median']:9.2f} {result['candidate_median']:9.2f} "
+              f"{100 * result['change']:+7.1f}% {ci:>17s} {p_value:>7s}  {result['status']}")
+
+
+def baseline_path(baseline_dir: str, name: str) -> str:
+    """
+    Resolve a baseline name (stored in the baseline directory) or a metrics file path.
+    """
+    if os.path.exists(name):
+        return name
+    return os.path.join(baseline_dir, f'{name}.json')
+
+
+def load_merged(paths: Iterable[str], label: str = '') -> RunMetrics:
+    merged = RunMetrics(label)
+    for path in paths:
+        run_metrics = RunMetrics.load(path)
+        merged.merge(run_metrics)
+        merged.label = merged.label or run_metrics.label
+    return merged
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Store run metrics as baseline and gate new runs against it.')
+    parser.add_argument('--baseline_dir', type=str, default=DEFAULT_BASELINE_DIR)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    save_parser = subparsers.add_parser('save', help='Store the metrics of one or more runs as a baseline.')
+    save_parser.add_argument('name', type=str, help='Baseline name, typically the firmware build.')
+    save_parser.add_argument('metrics_files', nargs='+')
+
+    compare_parser = subparsers.add_parser('compare', help='Compare the metrics of one or more runs to a baseline.')
+    compare_parser.add_argument('baseline', type=str, help='Baseline name or metrics file.')
+    compare_parser.add_argument('metrics_files', nargs='+')
+    compare_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                                help='Relative slowdown of the median over which a metric may fail (default: 0.10).')
+    compare_parser.add_argument('--alpha', type=float, default=DEFAULT_ALPHA)
+    compare_parser.add_argument('--max_lines', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == 'save':
+        os.makedirs(args.baseline_dir, exist_ok=True)
+        path = baseline_path(args.baseline_dir, args.name)
+        load_merged(args.metrics_files, args.name).save(path)
+        print(f'Baseline {args.name} saved to {path}')
+        sys.exit(0)
+
+    baseline = RunMetrics.load(baseline_path(args.baseline_dir, args.baseline))
+    candidate = load_merged(args.metrics_files)
+    results = compare_metrics(baseline, candidate, args.threshold, args.alpha)
+    print(f'Baseline: {baseline.label or args.baseline}, candidate: {candidate.label or ", ".join(args.metrics_files)}')
+    print_comparison(results, args.max_lines)
+    regressions = [r for r in results if r['status'] == 'FAIL']
+    if regressions:
+        print(f'\nGATE FAILED: {len(regressions)} regression(s), worst: ' +
+              ', '.join(f"{r['metric']} ({100 * r['change']:+.1f}%)" for r in regressions[:5]))
+        sys.exit(1)
+    print('\nGATE PASSED')
+    sys.exit(0)
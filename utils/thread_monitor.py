@@ -0,0 +1,227 @@
+import json
+import subprocess
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from typing import Deque, Dict, List, Optional
+
+from .tracing import traced
+
+OT_CTL = 'sudo ot-ctl'
+OT_CTL_TIMEOUT = 5
+
+# ot-ctl command run at each sample, keyed by the ThreadNetworkSample field it fills.
+SAMPLE_COMMANDS = {
+    'state': 'state',
+    'neighbors': 'neighbor table',
+    'routers': 'router table',
+    'children': 'child table',
+    'mac_counters': 'counters mac',
+    'mle_counters': 'counters mle',
+}
+
+
+@dataclass
+class ThreadNetworkSample:
+    """
+    Snapshot of the border router view of the Thread mesh.
+    """
+    timestamp: float
+    state: str = ''
+    neighbors: List[Dict[str, str]] = field(default_factory=list)
+    routers: List[Dict[str, str]] = field(default_factory=list)
+    children: List[Dict[str, str]] = field(default_factory=list)
+    mac_counters: Dict[str, int] = field(default_factory=dict)
+    mle_counters: Dict[str, int] = field(default_factory=dict)
+    errors: List[str] = field(default_factory=list)
+
+
+def run_ot_ctl(command: str, timeout: float = OT_CTL_TIMEOUT) -> List[str]:
+    """
+    Run an ot-ctl command and return its output lines without the trailing "Done".
+
+    Raises:
+        RuntimeError: If the command times out or does not end with "Done".
+    """
+    try:
+        result = subprocess.run(f'{OT_CTL} {command}', shell=True, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(f'ot-ctl {command}: timeout')
+    lines = [line.rstrip() for line in result.stdout.decode(errors='replace').splitlines() if line.strip()]
+    if not lines or lines[-1] != 'Done':
+        raise RuntimeError(f'ot-ctl {command}: {lines[-1] if lines else "no output"}')
+    return lines[:-1]
+
+
+def parse_table(lines: List[str]) -> List[Dict[str, str]]:
+    """
+    Parse an ot-ctl table (neighbor, router or child table) into a list of rows keyed by the header columns.
+    """
+    header: Optional[List[str]] = None
+    rows = []
+    for line in lines:
+        if not line.startswith('|'):
+            continue
+        cells = [cell.strip() for cell in line.strip().strip('|').split('|')]
+        if header is None:
+            header = cells
+        else:
+            rows.append(dict(zip(header, cells)))
+    return rows
+
+
+def parse_counters(lines: List[str]) -> Dict[str, int]:
+    """
+    Parse ot-ctl counters output ("Name: value" lines) into a dictionary.
+    """
+    counters = {}
+    for line in lines:
+        name, sep, value = line.partition(':')
+        if sep and value.strip().lstrip('-').isdigit():
+            counters[name.strip()] = int(value.strip())
+    return counters
+
+
+@traced('thread_network.sample')
+def take_sample() -> ThreadNetworkSample:
+    """
+    Poll the border router once. A failing command is recorded in the sample errors, the other fields are still filled.
+    """
+    sample = ThreadNetworkSample(timestamp=time.time())
+    for name, command in SAMPLE_COMMANDS.items():
+        try:
+            lines = run_ot_ctl(command)
+        except RuntimeError as e:
+            sample.errors.append(str(e))
+            continue
+        if name == 'state':
+            sample.state = lines[0] if lines else ''
+        elif name.endswith('_counters'):
+            setattr(sample, name, parse_counters(lines))
+        else:
+            setattr(sample, name, parse_table(lines))
+    return sample
+
+
+class ThreadNetworkSampler:
+    """
+    Background sampler of the Thread network health, as seen by the border router.
+
+    Samples are kept in a ring buffer ordered by timestamp so that the window of a failed iteration can be extracted
+    and stored next to its logs.
+    """
+
+    def __init__(self, interval: float = 10.0, buffer_size: int = 720):
+        self.interval = interval
+        self._samples: Deque[ThreadNetworkSample] = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='thread-network-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self.sample()
+            self._stop_event.wait(self.interval)
+
+    def sample(self) -> ThreadNetworkSample:
+        sample = take_sample()
+        with self._lock:
+            self._samples.append(sample)
+        return sample
+
+    def samples_between(self, start: float, end: float) -> List[ThreadNetworkSample]:
+        """
+        Return the samples taken between start and end (epoch seconds), including the last one before start so that
+        the state of the mesh when the window opened is known.
+        """
+        with self._lock:
+            samples = list(self._samples)
+        window = [s for s in samples if start <= s.timestamp <= end]
+        previous = [s for s in samples if s.timestamp < start]
+        if previous:
+            window.insert(0, previous[-1])
+        return window
+
+    def write_report(self, report_file: str, start: float, end: float,
+                     samples: Optional[List[ThreadNetworkSample]] = None, last_sample: bool = False) -> str:
+        """
+        Write the samples of a [start, end] window and their summary to a JSON report.
+
+        Args:
+            report_file (str): The JSON report to write.
+            start (float): Start of the window (epoch seconds).
+            end (float): End of the window (epoch seconds).
+            samples (List[ThreadNetworkSample], optional): The samples of the window, as returned by samples_between
+                when the window ended. Defaults to the samples currently in the buffer.
+            last_sample (bool, optional): Whether to poll the border router once more, so the report shows the mesh
+                state right after the window. Defaults to False.
+
+        Returns:
+            str: The report file.
+        """
+        if samples is None:
+            samples = self.samples_between(start, end)
+        if last_sample:
+            samples = samples + [self.sample()]
+        report = {
+            'window': {'start': start, 'end': end},
+            'summary': summarize_samples(samples),
+            'samples': [asdict(s) for s in samples],
+        }
+        with open(report_file, 'w') as f:
+            json.dump(report, f, indent=2)
+        return report_file
+
+
+def summarize_samples(samples: List[ThreadNetworkSample]) -> Dict:
+    """
+    Summarize a window of samples: border router state changes, worst RSSI / link quality per neighbor and the
+    counters increase over the window.
+    """
+    summary = {'sample_count': len(samples), 'states': [], 'neighbors': {}, 'counter_deltas': {}, 'errors': 0}
+    for sample in samples:
+        if sample.state and (not summary['states'] or summary['states'][-1] != sample.state):
+            summary['states'].append(sample.state)
+        summary['errors'] += len(sample.errors)
+        for neighbor in sample.neighbors:
+            mac = neighbor.get('Extended MAC', neighbor.get('RLOC16', '?'))
+            stats = summary['neighbors'].setdefault(mac, {'role': neighbor.get('Role', ''), 'samples': 0})
+            stats['samples'] += 1
+            for column in ('Avg RSSI', 'Last RSSI'):
+                value = neighbor.get(column, '')
+                if value.lstrip('-').isdigit():
+                    key = 'min_' + column.lower().replace(' ', '_')
+                    stats[key] = min(int(value), stats.get(key, int(value)))
+        for row in sample.routers + sample.children:
+            mac = row.get('Extended MAC')
+            if mac in summary['neighbors'] and row.get('LQ In', '').isdigit():
+                stats = summary['neighbors'][mac]
+                stats['min_lq_in'] = min(int(row['LQ In']), stats.get('min_lq_in', int(row['LQ In'])))
+
+    if len(samples) >= 2:
+        for name in ('mac_counters', 'mle_counters'):
+            first, last = getattr(samples[0], name), getattr(samples[-1], name)
+            deltas = {k: last[k] - first[k] for k in last if k in first and last[k] != first[k]}
+            if deltas:
+                summary['counter_deltas'][name] = deltas
+    # Neighbors that disappeared in the window are a strong hint of a mesh issue
+    if samples and not samples[-1].errors:
+        seen = set(summary['neighbors'])
+        last = {n.get('Extended MAC', n.get('RLOC16', '?')) for n in samples[-1].neighbors}
+        summary['lost_neighbors'] = sorted(seen - last)
+    return summary
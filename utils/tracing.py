@@ -0,0 +1,152 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+
+class Span:
+    """
+    A timed section of a run. Attributes can be added while the span is open (e.g. the PID of a subprocess).
+    """
+
+    def __init__(self, name: str, attributes: Dict[str, Any], parent: Optional['Span']):
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent is not None else 0
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+
+    def set(self, key: str, value: Any):
+        self.attributes[key] = value
+
+
+class _NoopSpan:
+    def set(self, key: str, value: Any):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """
+    Collect the spans of a run and export them as a Chrome trace (also opened by Perfetto and chrome://tracing).
+
+    Spans opened while another span is open on the same thread are nested under it.
+    """
+
+    def __init__(self):
+        self._events: List[Dict] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+        self._thread_names: Dict[int, str] = {}
+
+    def _stack(self) -> List[Span]:
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        stack = self._stack()
+        current = Span(name, attributes, stack[-1] if stack else None)
+        stack.append(current)
+        try:
+            yield current
+        except BaseException as e:
+            current.set('error', repr(e))
+            raise
+        finally:
+            current.end = time.perf_counter()
+            stack.pop()
+            self._record(current)
+
+    def _record(self, span: Span):
+        thread = threading.current_thread()
+        event = {
+            'name': span.name,
+            'cat': span.name.split('.')[0],
+            'ph': 'X',
+            'ts': (span.start - self._origin) * 1e6,
+            'dur': (span.end - span.start) * 1e6,
+            'pid': self._pid,
+            'tid': thread.ident,
+            'args': {k: v if isinstance(v, (int, float, bool, type(None))) else str(v)
+                     for k, v in span.attributes.items()},
+        }
+        if span.parent is not None:
+            event['args']['parent'] = span.parent.name
+        with self._lock:
+            self._thread_names[thread.ident] = thread.name
+            self._events.append(event)
+
+    def export(self, path: str):
+        """
+        Write the recorded spans to a Chrome trace JSON file.
+        """
+        with self._lock:
+            events = list(self._events)
+            thread_names = dict(self._thread_names)
+        metadata = [{'name': 'process_name', 'ph': 'M', 'pid': self._pid, 'args': {'name': 'chip-tool-automation'}}]
+        metadata += [{'name': 'thread_name', 'ph': 'M', 'pid': self._pid, 'tid': tid, 'args': {'name': name}}
+                     for tid, name in thread_names.items()]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': metadata + sorted(events, key=lambda e: e['ts']), 'displayTimeUnit': 'ms'}, f)
+
+
+# Tracer of the run, None when tracing is disabled
+tracer: Optional[Tracer] = None
+
+
+def start_tracing() -> Tracer:
+    global tracer
+    tracer = Tracer()
+    return tracer
+
+
+def stop_tracing(path: Optional[str] = None):
+    """
+    Stop tracing and export the spans recorded so far (if a path is given).
+    """
+    global tracer
+    if tracer is not None and path:
+        tracer.export(path)
+    tracer = None
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Open a span on the run tracer, does nothing when tracing is disabled.
+    """
+    if tracer is None:
+        yield NOOP_SPAN
+        return
+    with tracer.span(name, **attributes) as current:
+        yield current
+
+
+def traced(name: Optional[str] = None):
+    """
+    Decorator opening a span for each call of the decorated function.
+    """
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def traced_sleep(seconds: float):
+    with span('sleep', seconds=seconds):
+        time.sleep(seconds)